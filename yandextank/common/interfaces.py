@@ -114,6 +114,27 @@ class AggregateResultListener(object):
         """
         raise NotImplementedError("Abstract method needs to be overridden")
 
+    def on_cumulative_data(self, data, final):
+        """
+        notification about whole-test aggregates, it is sent periodically
+        and at the end of test (final is True then) if aggregator.cumulative
+        is enabled
+
+        data has the same form as aggregated data, with an additional "steps"
+        list of load plan steps, each with its "reqps", "start", "end"
+        timestamps and aggregated "data"
+        """
+        pass
+
+    def on_correction_data(self, data):
+        """
+        notification about samples that came later than
+        aggregator.max_lateness, for a second that was already sent.
+        data has the same form as aggregated data and should be merged
+        into the second with the same "ts"
+        """
+        pass
+
 
 class AbstractInfoWidget(object):
     ''' InfoWidgets interface
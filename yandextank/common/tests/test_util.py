@@ -1,5 +1,7 @@
+import threading as th
+import time
 from queue import Queue
-from yandextank.common.util import Drain, Chopper
+from yandextank.common.util import Drain, Chopper, FileFollower
 
 
 class TestDrain(object):
@@ -41,3 +43,32 @@ class TestChopper(object):
         source = (range(i) for i in range(5))
         expected = [0, 0, 1, 0, 1, 2, 0, 1, 2, 3]
         assert list(Chopper(source)) == expected
+
+
+class TestFileFollower(object):
+    def test_read(self, tmpdir):
+        log = tmpdir.join('phout.log')
+        log.write('first\n')
+        follower = FileFollower(str(log))
+        assert follower.read(3) == 'fir'
+        # there is more to read
+        assert follower.wait(10)
+        assert follower.read(100) == 'st\n'
+        start = time.time()
+        assert not follower.wait(0.1)
+        assert time.time() - start < 1
+        follower.close()
+
+    def test_wait_for_growth(self, tmpdir):
+        log = tmpdir.join('phout.log')
+        log.write('')
+        follower = FileFollower(str(log), poll_interval=0.01)
+        assert follower.read(100) == ''
+        writer = th.Timer(0.1, lambda: log.write('second\n', mode='a'))
+        writer.start()
+        start = time.time()
+        assert follower.wait(10)
+        assert time.time() - start < 5
+        assert follower.read(100) == 'second\n'
+        writer.join()
+        follower.close()
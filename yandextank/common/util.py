@@ -5,6 +5,7 @@ import os
 import pwd
 import socket
 import threading as th
+import time
 import traceback
 
 import http.client
@@ -597,3 +598,55 @@ class Chopper(object):
         for chunk in self.source:
             for item in chunk:
                 yield item
+
+
+class FileFollower(object):
+    """
+    File that is still being written by another process. read returns
+    what is in the file at the moment, wait blocks until the file grows
+    past what has been read, so readers sleep only when there is nothing
+    to read. File size is polled every poll_interval seconds
+    """
+
+    def __init__(self, filename, mode='r', poll_interval=0.05):
+        self.file = open(filename, mode)
+        self.poll_interval = poll_interval
+        # file size when it was read to the end, None if it was not
+        self.seen = None
+
+    def size(self):
+        return os.fstat(self.file.fileno()).st_size
+
+    def read(self, size=-1):
+        seen = self.size()
+        # python 2 file keeps EOF state once it is hit, even if the file
+        # has grown since, seek clears it
+        self.file.seek(0, 1)
+        data = self.file.read(size)
+        self.seen = None if 0 < size <= len(data) else seen
+        return data
+
+    def mark(self, seen):
+        """
+        Remember that the file was read up to seen bytes, for readers that
+        do not read with read (mmap)
+        """
+        self.seen = seen
+
+    def wait(self, timeout):
+        """
+        Wait until there is something new to read, False on timeout
+        """
+        deadline = time.time() + timeout
+        while self.seen is not None and self.size() <= self.seen:
+            left = deadline - time.time()
+            if left <= 0:
+                return False
+            time.sleep(min(self.poll_interval, left))
+        return True
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
@@ -1,8 +1,13 @@
 # -*- coding: UTF-8 -*-
 import logging
 import numpy as np
+import pandas as pd
 import time
 from collections import Counter
+from functools import reduce
+
+from . import histogram, instrumentation
+from .tags import UNTAGGED, registry
 
 logger = logging.getLogger(__name__)
 
@@ -12,6 +17,9 @@ phout_columns = [
     'proto_code'
 ]
 
+# bigger values are counted with np.unique, that sorts them
+MAX_BINCOUNT_VALUE = 1024
+
 phantom_config = {
     "interval_real": ["total", "max", "min", "hist", "q", "len"],
     "connect_time": ["total", "max", "min", "len"],
@@ -31,23 +39,11 @@ class Worker(object):
     Aggregate Pandas dataframe or dict with numpy ndarrays in it
     """
 
-    def __init__(self, config, verbose_histogram):
+    def __init__(
+            self, config, verbose_histogram, quantile_histogram=None,
+            sampler=None):
         if verbose_histogram:
-            bins = np.linspace(0, 4990, 500)  # 10µs accuracy
-            bins = np.append(bins,
-                             np.linspace(5000, 9900, 50))  # 100µs accuracy
-            bins = np.append(bins,
-                             np.linspace(10, 499, 490) * 1000)  # 1ms accuracy
-            bins = np.append(bins,
-                             np.linspace(500, 2995, 500) * 1000)  # 5ms accuracy
-            bins = np.append(bins, np.linspace(3000, 9990, 700) *
-                             1000)  # 10ms accuracy
-            bins = np.append(bins, np.linspace(10000, 29950, 400) *
-                             1000)  # 50ms accuracy
-            bins = np.append(bins, np.linspace(30000, 119900, 900) *
-                             1000)  # 100ms accuracy
-            bins = np.append(bins, np.linspace(120, 300, 181) *
-                             1000000)  # 1s accuracy
+            bins = histogram.verbose_bins()
         else:
             # yapf: disable
             bins = np.array([
@@ -63,6 +59,14 @@ class Worker(object):
             # yapf: enable
 
         self.bins = bins
+        self.verbose_histogram = verbose_histogram
+        self.histogram = histogram.BinnedHistogram(bins)
+        # quantiles are calculated from this one in fold/merge/finalize mode
+        if quantile_histogram is None:
+            quantile_histogram = histogram.get_histogram('verbose')
+        self.quantile_histogram = quantile_histogram
+        # histograms and quantiles are calculated on a sample with it
+        self.sampler = sampler
         self.percentiles = np.array([50, 75, 80, 85, 90, 95, 98, 99, 100])
         self.config = config
         self.aggregators = {
@@ -75,14 +79,59 @@ class Worker(object):
             "count": self._count,
             "len": self._len,
         }
+        self.folders = {
+            "hist": self._fold_histogram,
+            "q": self._fold_quantiles,
+            "mean": self._fold_mean,
+            "total": self._total,
+            "min": self._min,
+            "max": self._max,
+            "count": self._fold_count,
+            "len": self._len,
+        }
+        self.mergers = {
+            "hist": histogram.merge,
+            "q": self._merge_quantiles,
+            "mean": self._merge_mean,
+            "total": lambda a, b: a + b,
+            "min": min,
+            "max": max,
+            "count": lambda a, b: a + b,
+            "len": lambda a, b: a + b,
+        }
+        self.group_folders = {
+            "hist": self._fold_group_histograms,
+            "q": self._fold_group_quantiles,
+            "mean": self._fold_group_means,
+            "total": self._fold_group_totals,
+            "min": self._fold_group_mins,
+            "max": self._fold_group_maxs,
+            "count": self._fold_group_counts,
+            "len": self._fold_group_lens,
+        }
+        self.finalizers = {
+            "hist": self._histogram_from_counts,
+            "q": self._quantiles_from_counts,
+            "mean": self._mean_from_sums,
+            "count": self._count_from_counter,
+        }
+
+    def _sample(self, values, codes=None, starts=None):
+        """
+        Every step-th sample (of every group, if group codes and starts
+        of sorted groups are given) and the step. The first sample of a
+        group is always taken, so no group becomes empty
+        """
+        step = self.sampler.step if self.sampler else 1
+        if step == 1:
+            return values, codes, step
+        if codes is None:
+            return np.asarray(values)[::step], None, step
+        mask = (np.arange(len(values)) - starts[codes]) % step == 0
+        return values[mask], codes[mask], step
 
     def _histogram(self, series):
-        data, bins = np.histogram(series, bins=self.bins)
-        mask = data > 0
-        return {
-            "data": [e.item() for e in data[mask]],
-            "bins": [e.item() for e in bins[1:][mask]],
-        }
+        return self._histogram_from_counts(self._fold_histogram(series))
 
     def _mean(self, series):
         return series.mean().item()
@@ -96,16 +145,37 @@ class Worker(object):
     def _min(self, series):
         return series.min().item()
 
+    @staticmethod
+    def _value_counts(values):
+        """
+        Distinct values and their counts. Small non-negative integers (net
+        and http codes) are counted with bincount, no python object per
+        sample is created in any case
+        """
+        values = np.asarray(values)
+        if not len(values):
+            return [], []
+        if values.dtype.kind in 'iu':
+            min_value, max_value = values.min(), values.max()
+            if min_value >= 0 and max_value < MAX_BINCOUNT_VALUE:
+                counts = np.bincount(values)
+                uniques = np.flatnonzero(counts)
+                return uniques.tolist(), counts[uniques].tolist()
+        uniques, counts = np.unique(values, return_counts=True)
+        return uniques.tolist(), counts.tolist()
+
     def _count(self, series):
-        return {str(k): v for k, v in dict(Counter(series)).items()}
+        uniques, counts = self._value_counts(series)
+        return {str(k): v for k, v in zip(uniques, counts)}
 
     def _len(self, series):
         return len(series)
 
     def _quantiles(self, series):
+        values, _, _ = self._sample(series)
         return {
             "q": list(self.percentiles),
-            "value": list(np.percentile(series, self.percentiles)),
+            "value": list(np.percentile(values, self.percentiles)),
         }
 
     def aggregate(self, data):
@@ -117,17 +187,456 @@ class Worker(object):
             for key in self.config
         }
 
+    def empty(self):
+        """
+        Aggregates of a second without samples
+        """
+
+        def empty_aggregate(aggregate):
+            if aggregate == "hist":
+                return {"data": [], "bins": []}
+            if aggregate == "q":
+                return {
+                    "q": list(self.percentiles),
+                    "value": [0] * len(self.percentiles),
+                }
+            if aggregate == "count":
+                return {}
+            return 0
+
+        return {
+            key: {
+                aggregate: empty_aggregate(aggregate)
+                for aggregate in self.config[key]
+            }
+            for key in self.config
+        }
+
+    def _fold_histogram(self, series):
+        values, _, step = self._sample(series)
+        ids, counts = self.histogram.counts(values)
+        return ids, counts * step
+
+    def _histogram_from_counts(self, counts):
+        ids, data = counts
+        # the last one is an overflow bucket, np.histogram drops those samples
+        mask = ids < len(self.bins) - 1
+        return {
+            "data": data[mask].tolist(),
+            "bins": self.bins[ids[mask] + 1].tolist(),
+        }
+
+    def _fold_quantiles(self, series):
+        values, _, step = self._sample(series)
+        ids, counts = self.quantile_histogram.counts(values)
+        return (
+            (ids, counts * step), series.min().item(), series.max().item())
+
+    def _merge_quantiles(self, state, other):
+        return (
+            histogram.merge(state[0], other[0]), min(state[1], other[1]),
+            max(state[2], other[2]))
+
+    def _quantiles_from_counts(self, state):
+        counts, min_value, max_value = state
+        return {
+            "q": list(self.percentiles),
+            "value": self.quantile_histogram.quantiles(
+                counts, self.percentiles, min_value, max_value).tolist(),
+        }
+
+    def _fold_mean(self, series):
+        return (series.sum().item(), len(series))
+
+    def _merge_mean(self, state, other):
+        return (state[0] + other[0], state[1] + other[1])
+
+    def _mean_from_sums(self, state):
+        return float(state[0]) / state[1]
+
+    def _fold_count(self, series):
+        return Counter(dict(zip(*self._value_counts(series))))
+
+    def _count_from_counter(self, counter):
+        return {str(k): v for k, v in counter.items()}
+
+    def fold(self, data):
+        """
+        Fold samples into mergeable partial aggregates. Partials hold
+        sums, extremums, bucket and code counters only, not the samples
+        """
+        columns = {key: np.asarray(data[key]) for key in self.config}
+        return {
+            key: {
+                aggregate: self.folders[aggregate](columns[key])
+                for aggregate in self.config[key]
+            }
+            for key in self.config
+        }
+
+    def _fold_group_histograms(self, values, codes, starts):
+        sample, sample_codes, step = self._sample(values, codes, starts)
+        return [
+            (ids, counts * step)
+            for ids, counts in self.histogram.group_counts(
+                sample, sample_codes, len(starts))
+        ]
+
+    def _fold_group_quantiles(self, values, codes, starts):
+        sample, sample_codes, step = self._sample(values, codes, starts)
+        return list(
+            zip(
+                [(ids, counts * step)
+                 for ids, counts in self.quantile_histogram.group_counts(
+                     sample, sample_codes, len(starts))],
+                self._fold_group_mins(values, codes, starts),
+                self._fold_group_maxs(values, codes, starts)))
+
+    def _fold_group_means(self, values, codes, starts):
+        return list(
+            zip(
+                self._fold_group_totals(values, codes, starts),
+                self._fold_group_lens(values, codes, starts)))
+
+    def _fold_group_totals(self, values, codes, starts):
+        return np.add.reduceat(values, starts).tolist()
+
+    def _fold_group_mins(self, values, codes, starts):
+        return np.minimum.reduceat(values, starts).tolist()
+
+    def _fold_group_maxs(self, values, codes, starts):
+        return np.maximum.reduceat(values, starts).tolist()
+
+    def _fold_group_lens(self, values, codes, starts):
+        return np.diff(np.append(starts, len(values))).tolist()
+
+    def _fold_group_counts(self, values, codes, starts):
+        uniques, inverse = np.unique(values, return_inverse=True)
+        pairs, counts = np.unique(
+            codes * len(uniques) + inverse.ravel(), return_counts=True)
+        uniques = uniques.tolist()
+        counters = [Counter() for _ in starts]
+        for pair, count in zip(pairs.tolist(), counts.tolist()):
+            group, value = divmod(pair, len(uniques))
+            counters[group][uniques[value]] = count
+        return counters
+
+    def fold_groups(self, data, codes, n_groups):
+        """
+        Fold samples into a partial aggregate per group in a single pass.
+        Codes are group numbers of samples, every group in range(n_groups)
+        should have at least one sample. Samples are sorted by group once,
+        then every aggregate is calculated for all groups with one numpy call
+        """
+        order = np.argsort(codes, kind='mergesort')
+        codes = codes[order]
+        starts = np.searchsorted(codes, np.arange(n_groups))
+        states = {
+            key: {
+                aggregate: self.group_folders[aggregate](
+                    np.asarray(data[key])[order], codes, starts)
+                for aggregate in self.config[key]
+            }
+            for key in self.config
+        }
+        return [{
+            key: {
+                aggregate: states[key][aggregate][group]
+                for aggregate in self.config[key]
+            }
+            for key in self.config
+        } for group in range(n_groups)]
+
+    def fold_by(self, data, keys):
+        """
+        Fold samples into a partial aggregate per distinct combination
+        of keys, in a single pass. Keys are sequences of samples length.
+        Returns a list of (<key tuple>, <partial>) tuples, missing (NaN)
+        key values are reported as None
+        """
+        codes = np.zeros(len(data), dtype=np.int64)
+        levels = []
+        for key in keys:
+            key_codes, uniques = pd.factorize(key)
+            level = [None] + np.asarray(uniques).tolist()
+            # NaN is coded with -1
+            codes = codes * len(level) + key_codes + 1
+            levels.append(level)
+        group_codes, group_keys = pd.factorize(codes)
+        partials = self.fold_groups(data, group_codes, len(group_keys))
+        result = []
+        for code, partial in zip(group_keys.tolist(), partials):
+            key = []
+            for level in reversed(levels):
+                code, value = divmod(code, len(level))
+                key.append(level[value])
+            result.append((tuple(reversed(key)), partial))
+        return result
+
+    def merge(self, partial, other):
+        """
+        Merge two partial aggregates into a new one. Arguments are not changed
+        """
+        return {
+            key: {
+                aggregate: self.mergers[aggregate](
+                    partial[key][aggregate], other[key][aggregate])
+                for aggregate in self.config[key]
+            }
+            for key in self.config
+        }
+
+    def finalize(self, partial):
+        """
+        Make an aggregate result from a partial one. The result has the same
+        form as the one returned by aggregate()
+        """
+        return {
+            key: {
+                aggregate: self.finalizers.get(aggregate, lambda x: x)(
+                    partial[key][aggregate])
+                for aggregate in self.config[key]
+            }
+            for key in self.config
+        }
+
+
+class GroupBy(object):
+    """
+    Composite group by: samples are additionally grouped by a combination
+    of columns (tag and any other phout columns, like proto_code). Columns
+    are folded together with tag in the same pass, so no regrouping is
+    needed. Every column has no more than max_values distinct values
+    during a test, the others are merged into OTHER. Untagged samples and
+    samples with missing values are not grouped
+    """
+    OTHER = '__other__'
+
+    def __init__(self, columns, max_values=100, tags=registry):
+        self.columns = list(columns)
+        # columns that are folded in addition to tag
+        self.extra = [column for column in self.columns if column != 'tag']
+        self.max_values = max_values
+        self.tags = tags
+        self.seen = {column: set() for column in self.columns}
+
+    def keys(self, data):
+        """
+        Extra fold_by keys for a dataframe
+        """
+        return [data[column] for column in self.extra]
+
+    def _cap(self, column, value):
+        seen = self.seen[column]
+        if value not in seen:
+            if len(seen) >= self.max_values:
+                return self.OTHER
+            seen.add(value)
+        return value
+
+    def group(self, tag, values):
+        """
+        Group key (values of columns, in columns order) for a tag and values
+        of extra columns, None if samples are not grouped
+        """
+        if tag is None or tag == UNTAGGED or None in values:
+            return None
+        values = dict(zip(self.extra, values), tag=tag)
+        return tuple(
+            self._cap(column, values[column]) for column in self.columns)
+
+    def _name(self, column, value):
+        if column == 'tag' and value != self.OTHER:
+            return self.tags.name(value)
+        return str(value)
+
+    def nest(self, grouped, finalize):
+        """
+        Finalized aggregates nested by columns:
+        {<value of 1st column>: {<value of 2nd column>: <aggregates>}}
+        """
+        result = {}
+        for key, partial in grouped.items():
+            node = result
+            for column, value in zip(self.columns[:-1], key[:-1]):
+                node = node.setdefault(self._name(column, value), {})
+            node[self._name(self.columns[-1], key[-1])] = finalize(partial)
+        return result
+
+
+class Accumulator(object):
+    """
+    Mergeable aggregates of one second of data, by tag. Tags are kept
+    as they come (interned tag ids usually). Samples without a tag are
+    counted in overall only, as in the dataframe pipeline. With grouping,
+    partials are also kept by composite group keys
+    """
+
+    def __init__(self, worker, groupby='tag', grouping=None):
+        self.worker = worker
+        self.groupby = groupby
+        self.grouping = grouping
+        self.tagged = {}
+        self.untagged = None
+        self.grouped = {}
+
+    def _merge_into(self, partials, key, partial):
+        if key in partials:
+            partials[key] = self.worker.merge(partials[key], partial)
+        else:
+            partials[key] = partial
+
+    def add(self, tag, partial, values=()):
+        """
+        Merge a partial aggregate of a tag in. None and UNTAGGED are for
+        untagged samples. Values are the ones of grouping extra columns
+        """
+        if tag is None or tag == UNTAGGED:
+            if self.untagged is None:
+                self.untagged = partial
+            else:
+                self.untagged = self.worker.merge(self.untagged, partial)
+        else:
+            self._merge_into(self.tagged, tag, partial)
+        if self.grouping is not None:
+            key = self.grouping.group(tag, values)
+            if key is not None:
+                self._merge_into(self.grouped, key, partial)
+
+    def fold(self, data):
+        keys = [data[self.groupby]]
+        if self.grouping is not None:
+            keys += self.grouping.keys(data)
+        for key, partial in self.worker.fold_by(data, keys):
+            self.add(key[0], partial, key[1:])
+
+    def overall(self):
+        partials = list(self.tagged.values())
+        if self.untagged is not None:
+            partials.append(self.untagged)
+        return reduce(self.worker.merge, partials)
+
+
+class Cumulative(object):
+    """
+    Whole-test aggregates: per-second partials are merged into running
+    overall, per tag and per load plan step partials. Memory is bounded
+    whatever long the test is: partials have fixed size, tags beyond
+    max_tags are merged into OTHER_TAG and seconds beyond max_steps steps
+    are merged into the last step
+    """
+    OTHER_TAG = '__other__'
+
+    def __init__(self, worker, max_tags=1000, max_steps=1000, tags=registry):
+        self.worker = worker
+        self.tags = tags
+        self.max_tags = max_tags
+        self.max_steps = max_steps
+        self.ts = None
+        self.overall = None
+        self.tagged = {}
+        self.steps = []
+
+    def _merge(self, partial, other):
+        if partial is None:
+            return other
+        return self.worker.merge(partial, other)
+
+    def add(self, ts, accumulator, reqps=None):
+        """
+        Merge a second in. Load plan steps are sequences of seconds with
+        the same planned reqps
+        """
+        self.ts = ts if self.ts is None else max(self.ts, ts)
+        overall = accumulator.overall()
+        self.overall = self._merge(self.overall, overall)
+        for tag, partial in accumulator.tagged.items():
+            if tag not in self.tagged and len(self.tagged) >= self.max_tags:
+                tag = self.OTHER_TAG
+            self.tagged[tag] = self._merge(self.tagged.get(tag), partial)
+        if reqps is None:
+            return
+        new_step = self.steps and self.steps[-1]['reqps'] != reqps
+        if not self.steps or (new_step and len(self.steps) < self.max_steps):
+            self.steps.append({
+                'reqps': reqps,
+                'start': ts,
+                'end': ts,
+                'partial': overall,
+            })
+        else:
+            step = self.steps[-1]
+            step['start'] = min(step['start'], ts)
+            step['end'] = max(step['end'], ts)
+            step['partial'] = self.worker.merge(step['partial'], overall)
+
+    def get(self):
+        """
+        Finalized aggregates in the same form as per-second ones
+        """
+        if self.overall is None:
+            return None
+        return {
+            "ts": self.ts,
+            "overall": self.worker.finalize(self.overall),
+            "tagged": {
+                self.tags.name(tag): self.worker.finalize(partial)
+                for tag, partial in self.tagged.items()
+            },
+            "steps": [{
+                "reqps": step['reqps'],
+                "start": step['start'],
+                "end": step['end'],
+                "data": self.worker.finalize(step['partial']),
+            } for step in self.steps],
+        }
+
+
+class AggregateResult(dict):
+    """
+    Aggregated second. Partial aggregates it was made from are kept in
+    accumulator attribute, if there were any, listeners only see a dict.
+    Late results are corrections for seconds that were already passed.
+    Histograms and quantiles were calculated on sample_rate share of samples
+    """
+    accumulator = None
+    late = False
+    sample_rate = 1.0
+
+
+class Late(object):
+    """
+    Samples of a second that was already passed further
+    """
+
+    def __init__(self, data):
+        self.data = data
+
 
 class DataPoller(object):
+    """
+    Passes chunks of a source, None means there is no data at the moment.
+    Sources that can wait for data (readers of growing files have wait
+    method) are read with no sleeps while there is a backlog and are waited
+    for up to poll_period when they are drained, other sources are polled
+    once in poll_period
+    """
+
     def __init__(self, source, poll_period):
         self.poll_period = poll_period
         self.source = source
 
     def __iter__(self):
+        wait = getattr(self.source, 'wait', None)
         for chunk in self.source:
             if chunk is not None:
                 yield chunk
-            time.sleep(self.poll_period)
+                if wait is not None:
+                    continue
+            if wait is not None:
+                wait(self.poll_period)
+            else:
+                time.sleep(self.poll_period)
 
 
 def to_utc(ts):
@@ -140,22 +649,74 @@ def to_utc(ts):
 
 
 class Aggregator(object):
-    def __init__(self, source, config, verbose_histogram):
-        self.worker = Worker(config, verbose_histogram)
+    def __init__(
+            self, source, config, verbose_histogram, vectorized=False,
+            quantile_histogram=None, keep_partials=False, tags=registry,
+            sampler=None, grouping=None):
+        self.worker = Worker(
+            config, verbose_histogram, quantile_histogram, sampler)
+        self.sampler = sampler
+        self.grouping = grouping
         self.source = source
+        self.tags = tags
         self.groupby = 'tag'
+        self.vectorized = vectorized
+        self.keep_partials = keep_partials
+
+    def _aggregate_dataframe(self, chunk):
+        by_tag = list(chunk.groupby(self.groupby))
+        return {
+            "tagged":
+            {self.tags.name(tag): self.worker.aggregate(data)
+             for tag, data in by_tag if tag != UNTAGGED},
+            "overall": self.worker.aggregate(chunk),
+        }
+
+    def _finalize_accumulator(self, accumulator):
+        result = {
+            "tagged": {
+                self.tags.name(tag): self.worker.finalize(partial)
+                for tag, partial in accumulator.tagged.items()
+            },
+            "overall": self.worker.finalize(accumulator.overall()),
+        }
+        if self.grouping is not None:
+            result["grouped"] = self.grouping.nest(
+                accumulator.grouped, self.worker.finalize)
+        return result
+
+    def _accumulate(self, chunk):
+        if isinstance(chunk, Accumulator):
+            return chunk
+        accumulator = Accumulator(self.worker, self.groupby, self.grouping)
+        accumulator.fold(chunk)
+        return accumulator
 
     def __iter__(self):
         for ts, chunk in self.source:
-            by_tag = list(chunk.groupby([self.groupby]))
             start_time = time.time()
-            result = {
-                "ts": ts,
-                "tagged":
-                {tag: self.worker.aggregate(data)
-                 for tag, data in by_tag},
-                "overall": self.worker.aggregate(chunk),
-            }
-            logger.debug(
-                "Aggregation time: %.2fms", (time.time() - start_time) * 1000)
+            accumulator = None
+            late = isinstance(chunk, Late)
+            if late:
+                chunk = chunk.data
+            # groups are folded together with tags, so it is vectorized
+            if isinstance(chunk, Accumulator) or self.vectorized \
+                    or self.grouping is not None:
+                accumulator = self._accumulate(chunk)
+                result = AggregateResult(
+                    self._finalize_accumulator(accumulator))
+            else:
+                result = AggregateResult(self._aggregate_dataframe(chunk))
+                if self.keep_partials:
+                    accumulator = self._accumulate(chunk)
+            result["ts"] = ts
+            result.late = late
+            if self.keep_partials:
+                result.accumulator = accumulator
+            instrumentation.aggregate.add(
+                time.time() - start_time,
+                result['overall'].get('interval_real', {}).get('len', 0))
+            if self.sampler and not late:
+                result.sample_rate = self.sampler.rate
+                self.sampler.tick()
             yield result
@@ -2,9 +2,16 @@
 Split incoming DataFrames into chunks, cache them, union chunks with same key
 and pass to the underlying aggregator.
 """
+import multiprocessing as mp
+import time
+from collections import deque
 
 import pandas as pd
 
+from . import instrumentation
+from .aggregator import Accumulator, Late, Worker
+from .tags import registry
+
 
 class TimeChopper(object):
     """
@@ -33,3 +40,251 @@ class TimeChopper(object):
         while self.cache:
             key = min(self.cache.keys())
             yield (key, self.cache.pop(key, None))
+
+
+def _samples(partial):
+    """
+    Number of samples a partial aggregate was folded from
+    """
+    for aggregates in partial.values():
+        if 'len' in aggregates:
+            return aggregates['len']
+    return 0
+
+
+class AccumulatingChopper(object):
+    """
+    AccumulatingChopper folds incoming dataframes into per-second
+    accumulators as soon as they arrive, so no raw rows are cached or
+    concatenated. Accumulators are passed further as
+    (<timestamp>, <Accumulator>) tuples. A second is passed when there are
+    more than cache_size seconds in cache or, if max_lateness is set, when
+    the watermark has passed it, like in WatermarkChopper. Samples for
+    seconds that were already passed are late: they are passed further as
+    (<timestamp>, Late(<Accumulator>)) corrections or dropped if drop_late
+    is set, and counted in late_samples.
+    """
+
+    def __init__(
+            self, source, worker, cache_size, grouping=None,
+            max_lateness=None, drop_late=False):
+        self.cache_size = cache_size
+        self.source = source
+        self.worker = worker
+        self.grouping = grouping
+        self.max_lateness = max_lateness
+        self.drop_late = drop_late
+        self.cache = {}
+        self.max_ts = None
+        self.last_passed = None
+        self.late_samples = 0
+
+    def _folded(self):
+        """
+        Lists of ((<timestamp>, <tag>, <grouping values>...), <partial>)
+        for incoming chunks
+        """
+        for chunk in self.source:
+            start_time = time.time()
+            # all seconds, tags and groups of a chunk are folded in one pass
+            keys = [chunk.index, chunk['tag']]
+            if self.grouping is not None:
+                keys += self.grouping.keys(chunk)
+            folded = self.worker.fold_by(chunk, keys)
+            instrumentation.chop.add(time.time() - start_time, len(chunk))
+            yield folded
+
+    def _ready(self):
+        """
+        Seconds of cache that are passed further
+        """
+        if self.max_lateness is None:
+            keys = sorted(self.cache)
+            return keys[:max(len(keys) - self.cache_size, 0)]
+        if self.max_ts is None:
+            return []
+        watermark = self.max_ts - self.max_lateness
+        return sorted(key for key in self.cache if key < watermark)
+
+    def _add(self, cache, group_key, tag, partial, values):
+        if group_key not in cache:
+            cache[group_key] = Accumulator(
+                self.worker, grouping=self.grouping)
+        cache[group_key].add(tag, partial, values)
+
+    def __iter__(self):
+        for folded in self._folded():
+            late = {}
+            for key, partial in folded:
+                group_key, tag = key[:2]
+                if self.last_passed is not None and \
+                        group_key <= self.last_passed:
+                    self.late_samples += _samples(partial)
+                    if not self.drop_late:
+                        self._add(late, group_key, tag, partial, key[2:])
+                    continue
+                self._add(self.cache, group_key, tag, partial, key[2:])
+                if self.max_ts is None or group_key > self.max_ts:
+                    self.max_ts = group_key
+            for key in sorted(late):
+                yield (key, Late(late[key]))
+            for key in self._ready():
+                self.last_passed = key
+                yield (key, self.cache.pop(key))
+        for key in sorted(self.cache):
+            self.last_passed = key
+            yield (key, self.cache.pop(key))
+
+
+_process_parser = None
+_process_worker = None
+
+
+_process_columns = []
+
+
+def _init_process(
+        parser, config, verbose_histogram, quantile_histogram, columns):
+    global _process_parser, _process_worker, _process_columns
+    _process_parser = parser
+    _process_worker = Worker(config, verbose_histogram, quantile_histogram)
+    _process_columns = columns
+
+
+def _parse_and_fold(data):
+    """
+    Runs in worker processes. Tag ids are local to a process,
+    so tag names are passed back. Returns
+    (<parse time>, <fold time>, <rows>, <folded>)
+    """
+    start_time = time.time()
+    chunk = _process_parser(data)
+    parsed_time = time.time()
+    keys = [chunk.index, chunk['tag']] + [
+        chunk[column] for column in _process_columns]
+    folded = [((key[0], registry.name(key[1])) + key[2:], partial)
+              for key, partial in _process_worker.fold_by(chunk, keys)]
+    return (
+        parsed_time - start_time, time.time() - parsed_time, len(chunk),
+        folded)
+
+
+def split_lines(data, parts):
+    """
+    Split a raw chunk into parts of complete lines
+    """
+    bounds = [0]
+    newline = '\n' if isinstance(data, str) else b'\n'
+    for i in range(1, parts):
+        pos = data.find(newline, max(len(data) * i // parts, bounds[-1]))
+        if pos < 0:
+            break
+        bounds.append(pos + 1)
+    bounds.append(len(data))
+    return [data[start:end] for start, end in zip(bounds[:-1], bounds[1:])
+            if end > start]
+
+
+class ParallelChopper(AccumulatingChopper):
+    """
+    ParallelChopper takes raw chunks (not parsed by a reader), parses them
+    and folds into partials in a pool of processes. The main process only
+    merges partials into per-second accumulators, like AccumulatingChopper.
+    Results are taken in order and no more than max_pending parts are
+    being processed at a time
+    """
+
+    def __init__(
+            self, source, worker, parser, processes, cache_size,
+            grouping=None, max_lateness=None, drop_late=False):
+        super(ParallelChopper, self).__init__(
+            source, worker, cache_size, grouping, max_lateness, drop_late)
+        self.processes = processes
+        self.max_pending = processes * 2
+        self.pool = mp.Pool(
+            processes, _init_process, (
+                parser, worker.config, worker.verbose_histogram,
+                worker.quantile_histogram,
+                grouping.extra if grouping is not None else []))
+
+    @staticmethod
+    def _get(result):
+        parse_time, fold_time, rows, folded = result.get()
+        instrumentation.parse.add(parse_time, rows)
+        instrumentation.chop.add(fold_time, rows)
+        return folded
+
+    def _folded(self):
+        pending = deque()
+        try:
+            for data in self.source:
+                for part in split_lines(data, self.processes):
+                    pending.append(
+                        self.pool.apply_async(_parse_and_fold, (part, )))
+                while pending:
+                    if not pending[0].ready() and \
+                            len(pending) <= self.max_pending:
+                        break
+                    yield self._get(pending.popleft())
+            while pending:
+                yield self._get(pending.popleft())
+        finally:
+            self.pool.terminate()
+            self.pool.join()
+
+
+class WatermarkChopper(object):
+    """
+    WatermarkChopper splits incoming dataframes by index like TimeChopper,
+    but a second is passed further only when the watermark (the latest
+    second seen minus max_lateness) has passed it. So every second is
+    passed once and no later than max_lateness seconds after it. Samples
+    that arrive for seconds that were already passed are late: they are
+    passed further as (<timestamp>, Late(<dataframe>)) corrections or
+    dropped if drop_late is set. Late samples are counted in late_samples.
+    """
+
+    def __init__(self, source, max_lateness, drop_late=False):
+        self.source = source
+        self.max_lateness = max_lateness
+        self.drop_late = drop_late
+        self.cache = {}
+        self.max_ts = None
+        self.last_passed = None
+        self.late_samples = 0
+
+    def _chop(self, chunk):
+        """
+        Cache a chunk, returns seconds and corrections that are ready
+        """
+        ready = []
+        for group_key, group_data in list(chunk.groupby(level=0)):
+            if self.last_passed is not None and group_key <= self.last_passed:
+                self.late_samples += len(group_data)
+                if not self.drop_late:
+                    ready.append((group_key, Late(group_data)))
+            elif group_key in self.cache:
+                self.cache[group_key] = pd.concat(
+                    [self.cache[group_key], group_data])
+            else:
+                self.cache[group_key] = group_data
+            if self.max_ts is None or group_key > self.max_ts:
+                self.max_ts = group_key
+        if self.max_ts is None:
+            return ready
+        watermark = self.max_ts - self.max_lateness
+        for key in sorted(k for k in self.cache if k < watermark):
+            self.last_passed = key
+            ready.append((key, self.cache.pop(key)))
+        return ready
+
+    def __iter__(self):
+        for chunk in self.source:
+            start_time = time.time()
+            ready = self._chop(chunk)
+            instrumentation.chop.add(time.time() - start_time, len(chunk))
+            for item in ready:
+                yield item
+        for key in sorted(self.cache):
+            self.last_passed = key
+            yield (key, self.cache.pop(key))
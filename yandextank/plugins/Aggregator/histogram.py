@@ -0,0 +1,229 @@
+# -*- coding: UTF-8 -*-
+"""
+Histogram backends. Histograms are kept as sparse (<bucket ids>, <counts>)
+tuples with sorted ids and no empty buckets, so they take fixed memory,
+never keep samples and are cheap to merge across seconds, tags and tanks.
+"""
+from functools import reduce
+
+import numpy as np
+
+try:
+    from math import gcd
+except ImportError:  # python 2
+    from fractions import gcd
+
+# bucket ids less than this are counted with bincount, without sorting
+BINCOUNT_LIMIT = 1 << 16
+
+
+def verbose_bins():
+    bins = np.linspace(0, 4990, 500)  # 10µs accuracy
+    bins = np.append(bins, np.linspace(5000, 9900, 50))  # 100µs accuracy
+    bins = np.append(bins, np.linspace(10, 499, 490) * 1000)  # 1ms accuracy
+    bins = np.append(bins, np.linspace(500, 2995, 500) * 1000)  # 5ms accuracy
+    bins = np.append(bins, np.linspace(3000, 9990, 700) * 1000)  # 10ms accuracy
+    bins = np.append(bins, np.linspace(10000, 29950, 400) * 1000)  # 50ms accuracy
+    bins = np.append(bins, np.linspace(30000, 119900, 900) * 1000)  # 100ms accuracy
+    bins = np.append(bins, np.linspace(120, 300, 181) * 1000000)  # 1s accuracy
+    return bins
+
+
+def merge(counts, other):
+    """
+    Merge two sparse histograms into a new one
+    """
+    ids, inverse = np.unique(
+        np.concatenate([counts[0], other[0]]), return_inverse=True)
+    return (
+        ids, np.bincount(
+            inverse.ravel(),
+            weights=np.concatenate([counts[1], other[1]])).astype(np.int64))
+
+
+class Histogram(object):
+    """
+    Base class for histogram backends. Backends map samples to bucket ids
+    and bucket ids back to values
+    """
+
+    def index(self, values):
+        """
+        Bucket id for every sample, -1 for samples that should be dropped
+        """
+        raise NotImplementedError("Abstract method needs to be overridden")
+
+    def upper(self, ids):
+        """
+        Upper bound of the values in buckets
+        """
+        raise NotImplementedError("Abstract method needs to be overridden")
+
+    def counts(self, values):
+        idx = self.index(values)
+        if len(idx) and idx.max() < BINCOUNT_LIMIT:
+            # dropped samples (-1) are counted in the first bucket
+            counts = np.bincount(idx + 1)[1:]
+            ids = np.flatnonzero(counts)
+            return ids, counts[ids]
+        return np.unique(idx[idx >= 0], return_counts=True)
+
+    def group_counts(self, values, codes, n_groups):
+        """
+        Histograms for each group at once, codes are group numbers of samples
+        """
+        idx = self.index(values)
+        mask = idx >= 0
+        # ids are non-negative and less than this, so flat ids are unique
+        width = idx.max() + 1 if mask.any() else 1
+        flat, counts = np.unique(
+            codes[mask] * width + idx[mask], return_counts=True)
+        groups, ids = np.divmod(flat, width)
+        bounds = np.searchsorted(groups, np.arange(n_groups + 1))
+        return [(ids[start:end], counts[start:end])
+                for start, end in zip(bounds[:-1], bounds[1:])]
+
+    def quantiles(self, counts, percentiles, min_value, max_value):
+        """
+        Quantiles are upper bounds of the buckets they fall into, clipped
+        by min and max values. So q100 is exact and the others are as precise
+        as buckets are
+        """
+        ids, counts = counts
+        if not len(ids):
+            return np.full(len(percentiles), max_value)
+        cumulative = np.cumsum(counts)
+        ranks = np.maximum(np.ceil(percentiles / 100.0 * cumulative[-1]), 1)
+        idx = np.minimum(np.searchsorted(cumulative, ranks), len(ids) - 1)
+        return np.clip(self.upper(ids[idx]), min_value, max_value)
+
+
+class BinnedHistogram(Histogram):
+    """
+    Buckets are [bins[i], bins[i + 1]) like in np.histogram (the last one is
+    closed). Samples bigger than the last edge go to an extra overflow bucket,
+    samples less than the first one are dropped.
+
+    Integer samples are mapped to buckets in constant time, whatever
+    the number of bins is. Bins are split into segments of equal width
+    buckets (there are a few of them in verbose bins), a segment is looked
+    up in a table of segments by value // resolution (resolution divides
+    all segment edges) and a bucket in a segment is found by division.
+    Bins that are not integers are searched for
+    """
+    # samples are processed by blocks that fit in CPU cache
+    BLOCK = 16384
+    MAX_LOOKUP = 1 << 20
+
+    def __init__(self, bins):
+        self.bins = bins
+        self.lookup = self._build_lookup(np.asarray(bins))
+
+    def _build_lookup(self, bins):
+        """
+        (<first edge>, <resolution>, <segment by value // resolution>,
+        <offsets>, <widths> of segments), None if bins are not integers
+        """
+        if len(bins) < 2:
+            return None
+        int_bins = bins.astype(np.int64)
+        if not np.array_equal(int_bins, bins) or np.any(np.diff(int_bins) <= 0):
+            return None
+        widths = np.diff(int_bins)
+        starts = np.append(0, np.flatnonzero(np.diff(widths)) + 1)
+        edges = int_bins[starts]
+        origin = edges[0]
+        resolution = reduce(gcd, (edges[1:] - origin).tolist(), 0) or \
+            int(int_bins[-1] - origin)
+        cells = (int_bins[-1] - origin) // resolution + 1
+        if cells > self.MAX_LOOKUP:
+            return None
+        segments = np.searchsorted(
+            edges - origin, np.arange(cells) * resolution, side='right') - 1
+        # bucket = (value - edge) // width + start = (value + offset) // width
+        offsets = starts * widths[starts] - (edges - origin)
+        return origin, resolution, segments, offsets, widths[starts]
+
+    def _lookup_index(self, values):
+        origin, resolution, segments, offsets, widths = self.lookup
+        idx = np.empty(len(values), dtype=np.int64)
+        for start in range(0, len(values), self.BLOCK):
+            block = values[start:start + self.BLOCK] - origin
+            segment = np.take(segments, block // resolution, mode='clip')
+            idx[start:start + self.BLOCK] = (
+                block + np.take(offsets, segment)) // np.take(widths, segment)
+        return np.clip(idx, -1, len(self.bins) - 1, out=idx)
+
+    def index(self, values):
+        values = np.asarray(values)
+        if self.lookup is not None and values.dtype.kind == 'i':
+            idx = self._lookup_index(values)
+        else:
+            idx = np.searchsorted(self.bins, values, side='right') - 1
+        idx[values == self.bins[-1]] = len(self.bins) - 2
+        return idx
+
+    def upper(self, ids):
+        # overflow bucket has no upper bound
+        return np.append(self.bins[1:], np.inf)[ids]
+
+
+class LogLinearHistogram(Histogram):
+    """
+    HdrHistogram-style log-linear buckets. Values less than sub_bucket_count
+    have their own buckets, then every power of two range is split into
+    sub_bucket_count / 2 linear buckets. So every value is represented with
+    a given number of significant decimal digits, and there are a few
+    thousands of buckets for the whole int64 range
+    """
+
+    def __init__(self, significant_digits=2):
+        if not 1 <= significant_digits <= 5:
+            raise ValueError(
+                "Significant digits should be in [1, 5], but it is %s" %
+                significant_digits)
+        self.significant_digits = significant_digits
+        self.sub_bucket_bits = int(
+            np.ceil(np.log2(2 * 10**significant_digits)))
+        self.sub_bucket_count = 2**self.sub_bucket_bits
+        self.sub_bucket_half_count = self.sub_bucket_count // 2
+
+    def index(self, values):
+        values = np.asarray(values).astype(np.int64)
+        idx = values.copy()
+        idx[values < 0] = -1
+        large = values >= self.sub_bucket_count
+        if large.any():
+            # frexp is exact for values less than 2**53
+            _, exponents = np.frexp(values[large].astype(np.float64))
+            shift = exponents.astype(np.int64) - self.sub_bucket_bits
+            sub_bucket = (values[large] >> shift) - self.sub_bucket_half_count
+            idx[large] = self.sub_bucket_count + sub_bucket + (
+                shift - 1) * self.sub_bucket_half_count
+        return idx
+
+    def upper(self, ids):
+        ids = np.asarray(ids, dtype=np.int64)
+        result = ids.copy()
+        large = ids >= self.sub_bucket_count
+        if large.any():
+            offset = ids[large] - self.sub_bucket_count
+            shift = offset // self.sub_bucket_half_count + 1
+            sub_bucket = self.sub_bucket_half_count + (
+                offset % self.sub_bucket_half_count)
+            # highest value that falls into this bucket
+            result[large] = ((sub_bucket + 1) << shift) - 1
+        return result
+
+
+BACKENDS = {
+    'verbose': lambda significant_digits: BinnedHistogram(verbose_bins()),
+    'log_linear': LogLinearHistogram,
+}
+
+
+def get_histogram(backend, significant_digits=2):
+    if backend not in BACKENDS:
+        raise NotImplementedError(
+            'No such histogram backend: "%s"' % backend)
+    return BACKENDS[backend](significant_digits)
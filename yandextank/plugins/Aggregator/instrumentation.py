@@ -0,0 +1,53 @@
+"""
+Aggregation pipeline self-instrumentation: time spent and rows processed
+by pipeline stages, queue sizes and aggregation lag. Published with expvar,
+so they could be read from anywhere in the tank process
+"""
+import time
+
+from ...common import expvar
+
+STAGES = ['parse', 'chop', 'aggregate']
+
+parse = expvar.publish('aggregator.parse', expvar.Timer())
+chop = expvar.publish('aggregator.chop', expvar.Timer())
+aggregate = expvar.publish('aggregator.aggregate', expvar.Timer())
+results_queue = expvar.publish('aggregator.results_queue', expvar.Int())
+stats_queue = expvar.publish('aggregator.stats_queue', expvar.Int())
+lag = expvar.publish('aggregator.lag', expvar.Var(0))
+
+
+class Snapshot(object):
+    """
+    Stage timers are totals, snapshots turn them into load (share of wall
+    time spent in a stage, may be more than 1 for stages that run in
+    several processes) and rows per second since the previous snapshot
+    """
+
+    def __init__(self):
+        self.last_time = time.time()
+        self.last = {name: expvar.get('aggregator.' + name).get()
+                     for name in STAGES}
+
+    def get(self):
+        now = time.time()
+        elapsed = max(now - self.last_time, 1e-6)
+        current = {name: expvar.get('aggregator.' + name).get()
+                   for name in STAGES}
+        stages = {}
+        for name in STAGES:
+            spent = current[name]['time'] - self.last[name]['time']
+            rows = current[name]['items'] - self.last[name]['items']
+            stages[name] = {
+                'load': spent / elapsed,
+                'rows_per_second': rows / elapsed,
+            }
+        self.last_time, self.last = now, current
+        return {
+            'stages': stages,
+            'queues': {
+                'results': results_queue.get(),
+                'stats': stats_queue.get(),
+            },
+            'lag': lag.get(),
+        }
@@ -1,13 +1,17 @@
 """ Core module to calculate aggregate data """
 import json
 import logging
+import time
 
 import queue as q
 from pkg_resources import resource_string
 from ...common.exceptions import PluginImplementationError
 
-from .aggregator import Aggregator, DataPoller
-from .chopper import TimeChopper
+from .aggregator import Aggregator, Cumulative, DataPoller, GroupBy, Worker
+from . import instrumentation
+from .histogram import get_histogram
+from .sampling import AdaptiveSampler
+from .chopper import AccumulatingChopper, ParallelChopper, WatermarkChopper
 from ...common.interfaces import AbstractPlugin
 from ...common.interfaces import AggregateResultListener
 from ...common.util import Drain, Chopper
@@ -23,6 +27,90 @@ class LoggingListener(AggregateResultListener):
         logger.info("Stats:\n%s", json.dumps(stats, indent=2))
 
 
+class StreamJoiner(object):
+    """
+    Ordered merge-join of aggregated data and stats items on ts.
+    Pairs are passed in strict ts order. A second is passed when both
+    items have come, when the stream that misses it has already passed
+    it, or when it has waited for the missing item for max_wait seconds
+    of wall clock time. Missing stats are filled with the last known ones,
+    seconds with no aggregated data are skipped (counted in no_data), as
+    listeners expect samples in every second they get. Items that come for
+    passed seconds are late: add_data and add_stats return False for them
+    and they are counted in late_data and late_stats
+    """
+
+    def __init__(self, max_wait, clock=time.time):
+        self.max_wait = max_wait
+        self.clock = clock
+        self.data = {}
+        self.stats = {}
+        # when the first item of a second has come
+        self.arrived = {}
+        # newest seconds seen on the streams
+        self.last_data_ts = float('-inf')
+        self.last_stat_ts = float('-inf')
+        self.last_ts = None
+        self.last_metrics = {'instances': 0, 'reqps': 0}
+        self.late_data = 0
+        self.late_stats = 0
+        self.no_data = 0
+
+    def _is_passed(self, ts):
+        return self.last_ts is not None and ts <= self.last_ts
+
+    def add_data(self, item):
+        ts = item['ts']
+        if self._is_passed(ts):
+            self.late_data += 1
+            return False
+        self.data[ts] = item
+        self.arrived.setdefault(ts, self.clock())
+        self.last_data_ts = max(ts, self.last_data_ts)
+        return True
+
+    def add_stats(self, item):
+        ts = item['ts']
+        if self._is_passed(ts):
+            self.late_stats += 1
+            return False
+        self.stats[ts] = item
+        self.arrived.setdefault(ts, self.clock())
+        self.last_stat_ts = max(ts, self.last_stat_ts)
+        return True
+
+    def _is_ready(self, ts):
+        if ts in self.data and ts in self.stats:
+            return True
+        if ts not in self.data and self.last_data_ts > ts:
+            return True
+        if ts not in self.stats and self.last_stat_ts > ts:
+            return True
+        return self.clock() - self.arrived[ts] > self.max_wait
+
+    def get(self, flush=False):
+        """
+        Ready (<data>, <stats>) pairs, all of them if flush is set
+        """
+        pairs = []
+        while self.data or self.stats:
+            ts = min(list(self.data.keys()) + list(self.stats.keys()))
+            if not flush and not self._is_ready(ts):
+                break
+            data = self.data.pop(ts, None)
+            stats = self.stats.pop(ts, None)
+            if stats is None:
+                stats = {'ts': ts, 'metrics': dict(self.last_metrics)}
+            del self.arrived[ts]
+            self.last_metrics = stats.get('metrics', self.last_metrics)
+            self.last_ts = ts
+            if data is None:
+                self.no_data += 1
+            else:
+                pairs.append((data, stats))
+        return pairs
+
+
 def get_from_queue(queue):
     data = []
     for _ in range(queue.qsize()):
@@ -49,13 +137,25 @@ class Plugin(AbstractPlugin):
         self.listeners = []  # [LoggingListener()]
         self.reader = None
         self.stats_reader = None
+        self.chopper = None
         self.results = q.Queue()
         self.stats = q.Queue()
-        self.data_cache = {}
-        self.stat_cache = {}
+        self.joiner = None
+        self.instrumentation = None
+        self.instrumentation_data = {}
+        self.cumulative = None
+        self.sampler = None
+        self.cumulative_period = 10
+        self.last_cumulative = 0
 
     def get_available_options(self):
-        return ["verbose_histogram"]
+        return [
+            "verbose_histogram", "streaming", "vectorized",
+            "histogram_backend", "significant_digits", "cumulative",
+            "cumulative_period", "max_lateness", "drop_late",
+            "parallel_workers", "join_timeout", "sampling",
+            "sampling_budget", "group_by", "max_group_values"
+        ]
 
     def start_test(self):
         aggregator_config = json.loads(
@@ -63,13 +163,81 @@ class Plugin(AbstractPlugin):
         verbose_histogram = self.get_option("verbose_histogram")
         if verbose_histogram:
             logger.info("using verbose histogram")
+        quantile_histogram = get_histogram(
+            self.get_option("histogram_backend"),
+            self.get_option("significant_digits"))
         if self.reader and self.stats_reader:
-            pipeline = Aggregator(
-                TimeChopper(
+            parallel_workers = self.get_option("parallel_workers")
+            grouping = None
+            if self.get_option("group_by"):
+                logger.info(
+                    "grouping by %s", ", ".join(self.get_option("group_by")))
+                grouping = GroupBy(
+                    self.get_option("group_by"),
+                    self.get_option("max_group_values"))
+            if self.get_option("sampling"):
+                logger.info(
+                    "sampling histograms to fit in %sms per second",
+                    self.get_option("sampling_budget"))
+                self.sampler = AdaptiveSampler(
+                    self.get_option("sampling_budget") / 1000.0)
+                if parallel_workers:
+                    logger.warning(
+                        "sampling is not applied in parallel workers")
+            parser = getattr(self.reader, 'parser', None)
+            if parallel_workers and parser is None:
+                logger.warning(
+                    "%s can't pass raw chunks, parsing in one process",
+                    type(self.reader).__name__)
+            if parallel_workers and parser is not None:
+                logger.info(
+                    "parsing and aggregating in %s processes",
+                    parallel_workers)
+                # chunks are parsed in worker processes
+                self.reader.parser = None
+                chopper = ParallelChopper(
+                    DataPoller(source=self.reader, poll_period=1),
+                    Worker(
+                        aggregator_config, verbose_histogram,
+                        quantile_histogram),
+                    parser,
+                    processes=parallel_workers,
+                    cache_size=3,
+                    grouping=grouping,
+                    max_lateness=self.get_option("max_lateness"),
+                    drop_late=self.get_option("drop_late"))
+            elif self.get_option("streaming"):
+                logger.info("using streaming accumulators")
+                chopper = AccumulatingChopper(
+                    DataPoller(source=self.reader, poll_period=1),
+                    Worker(
+                        aggregator_config, verbose_histogram,
+                        quantile_histogram, self.sampler),
+                    cache_size=3,
+                    grouping=grouping,
+                    max_lateness=self.get_option("max_lateness"),
+                    drop_late=self.get_option("drop_late"))
+            else:
+                chopper = WatermarkChopper(
                     DataPoller(source=self.reader, poll_period=1),
-                    cache_size=3),
+                    max_lateness=self.get_option("max_lateness"),
+                    drop_late=self.get_option("drop_late"))
+            self.chopper = chopper
+            pipeline = Aggregator(
+                chopper,
                 aggregator_config,
-                verbose_histogram)
+                verbose_histogram,
+                vectorized=self.get_option("vectorized"),
+                quantile_histogram=quantile_histogram,
+                keep_partials=self.get_option("cumulative"),
+                sampler=self.sampler,
+                grouping=grouping)
+            self.joiner = StreamJoiner(self.get_option("join_timeout"))
+            if self.get_option("cumulative"):
+                self.cumulative = Cumulative(pipeline.worker)
+                self.cumulative_period = self.get_option("cumulative_period")
+                self.last_cumulative = time.time()
+            self.instrumentation = instrumentation.Snapshot()
             self.drain = Drain(pipeline, self.results)
             self.drain.start()
             self.stats_drain = Drain(
@@ -82,35 +250,34 @@ class Plugin(AbstractPlugin):
                 "Generator must pass a Reader and a StatsReader"
                 " to Aggregator before starting test")
 
-    def _collect_data(self):
+    def _collect_data(self, flush=False):
         """
-        Collect data, cache it and send to listeners
+        Collect data, join it with stats and send to listeners
         """
+        instrumentation.results_queue.set(self.results.qsize())
+        instrumentation.stats_queue.set(self.stats.qsize())
         data = get_from_queue(self.results)
         stats = get_from_queue(self.stats)
         logger.debug("Data timestamps:\n%s" % [d.get('ts') for d in data])
         logger.debug("Stats timestamps:\n%s" % [d.get('ts') for d in stats])
         for item in data:
-            ts = item['ts']
-            if ts in self.stat_cache:
-                # send items
-                data_item = item
-                stat_item = self.stat_cache.pop(ts)
-                self.__notify_listeners(data_item, stat_item)
-            else:
-                self.data_cache[ts] = item
+            # data of a second that was passed without it, because it had
+            # waited for join_timeout, is a correction too
+            if getattr(item, 'late', False) or \
+                    not self.joiner.add_data(item):
+                self.__notify_correction(item)
         for item in stats:
-            ts = item['ts']
-            if ts in self.data_cache:
-                # send items
-                data_item = self.data_cache.pop(ts)
-                stat_item = item
-                self.__notify_listeners(data_item, stat_item)
-            else:
-                self.stat_cache[ts] = item
+            self.joiner.add_stats(item)
+        for data_item, stat_item in self.joiner.get(flush):
+            self.__notify_listeners(data_item, stat_item)
 
     def is_test_finished(self):
         self._collect_data()
+        self.__publish_instrumentation()
+        if self.cumulative and \
+                time.time() - self.last_cumulative >= self.cumulative_period:
+            self.last_cumulative = time.time()
+            self.__notify_cumulative(final=False)
         return -1
 
     def end_test(self, retcode):
@@ -122,13 +289,69 @@ class Plugin(AbstractPlugin):
             self.stats_reader.close()
         if self.stats_drain:
             self.stats_drain.join()
-        self._collect_data()
+        self._collect_data(flush=True)
+        late_samples = getattr(self.chopper, 'late_samples', 0)
+        if late_samples:
+            logger.warning(
+                "%s samples came later than max_lateness (%ss), %s",
+                late_samples, self.get_option("max_lateness"),
+                "dropped" if self.get_option("drop_late") else
+                "sent as corrections")
+        if self.joiner and self.joiner.late_data:
+            logger.warning(
+                "Aggregated data for %s seconds came later than join_timeout"
+                " (%ss), sent as corrections", self.joiner.late_data,
+                self.get_option("join_timeout"))
+        if self.joiner and self.joiner.no_data:
+            logger.info(
+                "%s seconds had stats but no aggregated data, skipped",
+                self.joiner.no_data)
+        if self.joiner and self.joiner.late_stats:
+            logger.warning(
+                "Stats for %s seconds came later than join_timeout (%ss),"
+                " dropped", self.joiner.late_stats,
+                self.get_option("join_timeout"))
+        if self.cumulative:
+            self.__notify_cumulative(final=True)
         return retcode
 
     def add_result_listener(self, listener):
         self.listeners.append(listener)
 
+    def __publish_instrumentation(self):
+        """ publish pipeline timings, queue sizes and lag to tank status """
+        if time.time() - self.instrumentation.last_time < 1:
+            return
+        self.instrumentation_data = self.instrumentation.get()
+        for key, value in self.instrumentation_data.items():
+            self.core.publish('aggregator', key, value)
+
     def __notify_listeners(self, data, stats):
         """ notify all listeners about aggregate data and stats """
+        instrumentation.lag.set(int(time.time()) - data['ts'])
+        if self.sampler:
+            stats.setdefault('metrics', {})['sample_rate'] = getattr(
+                data, 'sample_rate', 1.0)
+        if self.cumulative and getattr(data, 'accumulator', None):
+            self.cumulative.add(
+                data['ts'], data.accumulator,
+                stats.get('metrics', {}).get('reqps'))
         for listener in self.listeners:
             listener.on_aggregated_data(data, stats)
+
+    def __notify_correction(self, data):
+        """ notify listeners about late samples of already sent seconds """
+        if self.cumulative and getattr(data, 'accumulator', None):
+            self.cumulative.add(data['ts'], data.accumulator)
+        for listener in self.listeners:
+            if hasattr(listener, 'on_correction_data'):
+                listener.on_correction_data(data)
+
+    def __notify_cumulative(self, final):
+        """ notify listeners about whole-test aggregates """
+        data = self.cumulative.get()
+        if data is None:
+            return
+        for listener in self.listeners:
+            if hasattr(listener, 'on_cumulative_data'):
+                listener.on_cumulative_data(data, final)
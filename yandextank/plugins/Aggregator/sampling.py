@@ -0,0 +1,57 @@
+# -*- coding: UTF-8 -*-
+"""
+Adaptive sampling for very high RPS. Counters (len, totals, min/max, codes)
+are always calculated on all samples, histograms and quantiles are
+calculated on every step-th sample of a second and tag, so the sample is
+stratified and deterministic. Step adapts to keep aggregation time of
+a second under budget.
+"""
+from . import instrumentation
+
+
+def _time_spent():
+    """
+    Total time spent on folding and aggregation in this process
+    """
+    return instrumentation.chop.get()['time'] + \
+        instrumentation.aggregate.get()['time']
+
+
+class AdaptiveSampler(object):
+    """
+    Keeps sample step. Step is doubled when smoothed time spent per
+    aggregated second is over budget and halved when it is less than half
+    of budget (histograms would still fit then). Smoothing is reset when
+    step changes
+    """
+
+    def __init__(self, budget, max_step=1024, smoothing=0.3, clock=None):
+        self.budget = budget
+        self.max_step = max_step
+        self.smoothing = smoothing
+        self.clock = clock or _time_spent
+        self.step = 1
+        self.cost = None
+        self.last_spent = self.clock()
+
+    @property
+    def rate(self):
+        return 1.0 / self.step
+
+    def tick(self):
+        """
+        Called when a second is aggregated
+        """
+        spent = self.clock()
+        cost, self.last_spent = spent - self.last_spent, spent
+        if self.cost is None:
+            self.cost = cost
+        else:
+            self.cost = self.smoothing * cost + (
+                1 - self.smoothing) * self.cost
+        if self.cost > self.budget and self.step < self.max_step:
+            self.step = min(self.step * 2, self.max_step)
+            self.cost = None
+        elif self.cost < self.budget / 2.0 and self.step > 1:
+            self.step //= 2
+            self.cost = None
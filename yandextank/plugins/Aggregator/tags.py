@@ -0,0 +1,65 @@
+# -*- coding: UTF-8 -*-
+"""
+Tag interning. Readers put small integer tag ids into the 'tag' column
+instead of a python string per row, aggregator groups samples by ids and
+tag names are resolved only when results are passed to listeners.
+"""
+import numbers
+from threading import Lock
+
+import numpy as np
+import pandas as pd
+
+UNTAGGED = -1
+
+
+class TagRegistry(object):
+    """
+    Assigns stable ids to tag names in order of appearance.
+    Ids are never reused, so they are safe to keep between seconds
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.names = []
+        self.lock = Lock()
+
+    def intern(self, name):
+        tag_id = self.ids.get(name)
+        if tag_id is None:
+            with self.lock:
+                tag_id = self.ids.get(name)
+                if tag_id is None:
+                    tag_id = len(self.names)
+                    self.names.append(name)
+                    self.ids[name] = tag_id
+        return tag_id
+
+    def encode(self, tags, strip_marker=False):
+        """
+        Tag ids for a sequence of tag names, UNTAGGED for missing ones.
+        With strip_marker everything after the last '#' is cut off
+        (enum_ammo markers). Every distinct name is handled once
+        """
+        codes, uniques = pd.factorize(np.asarray(tags, dtype=object))
+        if strip_marker:
+            uniques = [name.rsplit('#', 1)[0] for name in uniques]
+        ids = np.array(
+            [self.intern(name) for name in uniques] + [UNTAGGED],
+            dtype=np.int32)
+        # missing tags have -1 code, that is the last id
+        return ids[codes]
+
+    def name(self, tag):
+        """
+        Tag name by id, None for untagged samples. Tags that are not
+        ids (readers that do not intern tags) are returned as is
+        """
+        if not isinstance(tag, numbers.Integral):
+            return tag
+        if tag == UNTAGGED:
+            return None
+        return self.names[tag]
+
+
+registry = TagRegistry()
@@ -3,6 +3,7 @@ import pandas as pd
 import numpy as np
 
 from yandextank.plugins.Aggregator.aggregator import phout_columns
+from yandextank.plugins.Aggregator.tags import registry
 
 np.random.seed(42)
 MAX_TS = 1000
@@ -13,17 +14,19 @@ def random_split(df):
     while True:
         step = np.random.randint(500, 1200)
         if i + step < len(df):
-            yield df.ix[i:i + step - 1]
+            yield df.loc[i:i + step - 1]
             i += step
         else:
-            yield df.ix[i:]
+            yield df.loc[i:]
             break
 
 
 @pytest.fixture
 def data():
+    np.random.seed(42)
     df = pd.DataFrame(
         np.random.randint(0, MAX_TS, (10000, len(phout_columns))),
         columns=phout_columns).set_index('time').sort_index()
-    df['tag'] = np.random.choice(list(range(3)), len(df))
+    df['tag'] = registry.encode(
+        np.random.choice(['tag0', 'tag1', 'tag2'], len(df)))
     return df
@@ -0,0 +1,172 @@
+import json
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+from pkg_resources import resource_string
+
+from conftest import MAX_TS
+from yandextank.plugins.Aggregator.aggregator import Aggregator, Cumulative, \
+    GroupBy, Worker
+from yandextank.plugins.Aggregator.chopper import AccumulatingChopper
+from yandextank.plugins.Aggregator.histogram import get_histogram
+from yandextank.plugins.Aggregator.tags import registry
+
+AGGR_CONFIG = json.loads(
+    resource_string("yandextank.plugins.Aggregator", 'config/phout.json')
+    .decode('utf-8'))
+
+
+class TestWorker(object):
+    def test_fold_groups(self, data):
+        worker = Worker(AGGR_CONFIG, True)
+        codes, tags = pd.factorize(data.tag)
+        partials = worker.fold_groups(data, codes, 3)
+        for tag, partial in zip(tags, partials):
+            expected = worker.finalize(worker.fold(data[data.tag == tag]))
+            assert worker.finalize(partial) == expected
+
+    def test_fold_by_missing_keys(self, data):
+        worker = Worker(AGGR_CONFIG, False)
+        tags = data.tag.map(registry.name)
+        tags[tags == 'tag2'] = None
+        keys = [key for key, _ in worker.fold_by(data, [tags])]
+        assert sorted(keys, key=str) == [('tag0', ), ('tag1', ), (None, )]
+
+    def test_merge(self, data):
+        worker = Worker(AGGR_CONFIG, False)
+        half = len(data) // 2
+        merged = worker.merge(
+            worker.fold(data.iloc[:half]), worker.fold(data.iloc[half:]))
+        assert worker.finalize(merged) == worker.finalize(worker.fold(data))
+
+    def test_empty(self, data):
+        worker = Worker(AGGR_CONFIG, False)
+        empty = worker.empty()
+        aggregated = worker.aggregate(data)
+        assert {key: sorted(value) for key, value in empty.items()} == \
+            {key: sorted(value) for key, value in aggregated.items()}
+        assert empty['interval_real']['len'] == 0
+        assert empty['interval_real']['q']['q'] == \
+            aggregated['interval_real']['q']['q']
+
+    def test_count(self):
+        worker = Worker(AGGR_CONFIG, False)
+        for codes in [
+                np.array([200, 404, 200, 0, 200]),
+                np.array([0, 110, 5000, 110]),  # too big for bincount
+                np.array([-1, 2, 2]),
+                np.array([], dtype=np.int64),
+        ]:
+            expected = {str(k): v for k, v in Counter(codes).items()}
+            assert worker._count(pd.Series(codes)) == expected
+            assert worker._count_from_counter(
+                worker._fold_count(codes)) == expected
+
+    def test_quantiles(self, data):
+        worker = Worker(AGGR_CONFIG, False)
+        result = worker.finalize(worker.fold(data))['interval_real']['q']
+        exact = np.percentile(data.interval_real, worker.percentiles)
+        # verbose histogram is 10us accurate for small values
+        assert np.allclose(result['value'], exact, atol=10)
+        assert result['value'][-1] == data.interval_real.max()
+
+
+class TestAggregator(object):
+    def test_vectorized(self, data):
+        seconds = list(data.groupby(level=0))[:100]
+        plain = list(Aggregator(seconds, AGGR_CONFIG, False))
+        vectorized = list(
+            Aggregator(seconds, AGGR_CONFIG, False, vectorized=True))
+        assert len(plain) == len(vectorized)
+        for expected, result in zip(plain, vectorized):
+            assert expected['ts'] == result['ts']
+            for key in ['total', 'min', 'max', 'len', 'hist']:
+                assert result['overall']['latency'].get(key) == \
+                    expected['overall']['latency'].get(key)
+                assert result['overall']['interval_real'][key] == \
+                    expected['overall']['interval_real'][key]
+            assert result['overall']['proto_code'] == \
+                expected['overall']['proto_code']
+            assert sorted(result['tagged']) == sorted(expected['tagged'])
+            assert set(result['tagged']) <= {'tag0', 'tag1', 'tag2'}
+
+    def test_log_linear(self, data):
+        seconds = list(data.groupby(level=0))[:100]
+        hist = get_histogram('log_linear', 2)
+        results = list(
+            Aggregator(
+                seconds, AGGR_CONFIG, False, vectorized=True,
+                quantile_histogram=hist))
+        for (ts, df), result in zip(seconds, results):
+            quantiles = result['overall']['interval_real']['q']['value']
+            exact = np.percentile(df.interval_real, [50, 100])
+            assert quantiles[-1] == exact[-1]
+            assert min(df.interval_real) <= quantiles[0] <= max(df.interval_real)
+
+
+class TestGroupBy(object):
+    def test_grouped(self, data):
+        data['proto_code'] = data.proto_code % 4 * 100
+        seconds = list(data.groupby(level=0))[:100]
+        worker = Worker(AGGR_CONFIG, False)
+        grouping = GroupBy(['tag', 'proto_code'])
+        for (ts, df), result in zip(
+                seconds, Aggregator(
+                    seconds, AGGR_CONFIG, False, grouping=grouping)):
+            assert sorted(result['grouped']) == sorted(result['tagged'])
+            for tag, by_code in result['grouped'].items():
+                assert sum(
+                    aggregates['interval_real']['len']
+                    for aggregates in by_code.values()) == \
+                    result['tagged'][tag]['interval_real']['len']
+                tagged = df[df.tag == registry.intern(tag)]
+                for code, aggregates in by_code.items():
+                    expected = tagged[tagged.proto_code == int(code)]
+                    assert aggregates == worker.finalize(
+                        worker.fold(expected))
+
+    def test_other(self, data):
+        grouping = GroupBy(['net_code', 'tag'], max_values=5)
+        worker = Worker(AGGR_CONFIG, False)
+        results = list(Aggregator(
+            AccumulatingChopper([data], worker, 3, grouping), AGGR_CONFIG,
+            False, grouping=grouping))
+        assert len(results) == MAX_TS
+        codes = set()
+        for result in results:
+            codes.update(result['grouped'])
+            assert sum(
+                aggregates['interval_real']['len']
+                for by_tag in result['grouped'].values()
+                for aggregates in by_tag.values()) == \
+                result['overall']['interval_real']['len']
+        assert len(codes) == 6
+        assert GroupBy.OTHER in codes
+
+
+class TestCumulative(object):
+    def test_whole_test(self, data):
+        worker = Worker(AGGR_CONFIG, False)
+        cumulative = Cumulative(worker, max_tags=2, max_steps=3)
+        for ts, chunk in AccumulatingChopper([data], worker, 3):
+            cumulative.add(ts, chunk, reqps=ts // 100)
+        result = cumulative.get()
+        expected = worker.finalize(worker.fold(data))
+        assert result['overall'] == expected
+        assert result['ts'] == MAX_TS - 1
+        assert len(result['tagged']) == 3
+        assert Cumulative.OTHER_TAG in result['tagged']
+        assert [s['reqps'] for s in result['steps']] == [0, 1, 2]
+        assert result['steps'][0]['end'] == 99
+        assert result['steps'][-1]['end'] == MAX_TS - 1
+        assert sum(
+            s['data']['interval_real']['len']
+            for s in result['steps']) == len(data)
+
+    def test_keep_partials(self, data):
+        seconds = list(data.groupby(level=0))[:10]
+        for result in Aggregator(
+                seconds, AGGR_CONFIG, False, keep_partials=True):
+            assert result.accumulator.overall()['interval_real']['len'] == \
+                result['overall']['interval_real']['len']
@@ -0,0 +1,113 @@
+from yandextank.plugins.Aggregator.plugin import StreamJoiner
+from yandextank.plugins.Autostop.criterions import AvgTimeCriterion
+
+
+def data(ts):
+    return {'ts': ts, 'overall': {}}
+
+
+def stats(ts, reqps=10):
+    return {'ts': ts, 'metrics': {'instances': 1, 'reqps': reqps}}
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestStreamJoiner(object):
+    def test_join(self):
+        joiner = StreamJoiner(5)
+        for ts in [1, 2, 3]:
+            joiner.add_data(data(ts))
+        assert joiner.get() == []
+        for ts in [1, 2]:
+            joiner.add_stats(stats(ts))
+        assert [(d['ts'], s['ts']) for d, s in joiner.get()] == [(1, 1), (2, 2)]
+        assert joiner.get(flush=True) == [(data(3), stats(3, 10))]
+
+    def test_missing_side(self):
+        joiner = StreamJoiner(5)
+        joiner.add_data(data(1))
+        joiner.add_data(data(3))
+        joiner.add_stats(stats(2, reqps=20))
+        joiner.add_stats(stats(3, reqps=30))
+        pairs = joiner.get()
+        # stats stream has passed second 1, data stream has passed second 2,
+        # which has no data and is skipped
+        assert [d['ts'] for d, _ in pairs] == [1, 3]
+        assert pairs[0][1] == {'ts': 1, 'metrics': {'instances': 0, 'reqps': 0}}
+        assert pairs[1] == (data(3), stats(3, reqps=30))
+        assert joiner.no_data == 1
+
+    def test_max_wait(self):
+        clock = Clock()
+        joiner = StreamJoiner(5, clock)
+        joiner.add_stats(stats(1))
+        for ts in range(1, 10):
+            joiner.add_data(data(ts))
+        # a lag between streams is not a timeout
+        assert [d['ts'] for d, _ in joiner.get()] == [1]
+        clock.now = 6
+        pairs = joiner.get()
+        # seconds that wait for stats more than 5 seconds are passed
+        assert [d['ts'] for d, _ in pairs] == list(range(2, 10))
+        assert all(s['metrics']['reqps'] == 10 for _, s in pairs)
+        assert not joiner.add_stats(stats(2))
+        assert joiner.late_stats == 1
+        assert joiner.get(flush=True) == []
+
+    def test_lagging_data(self):
+        clock = Clock()
+        joiner = StreamJoiner(10, clock)
+        sent = []
+        for ts in range(1, 41):
+            clock.now = ts
+            joiner.add_stats(stats(ts))
+            # aggregated data lags behind stats by 7 seconds
+            if ts > 7:
+                assert joiner.add_data(data(ts - 7))
+            sent.extend(d['ts'] for d, _ in joiner.get())
+        assert sent == list(range(1, 34))
+        assert joiner.no_data == 0
+        assert joiner.late_data == 0
+        # stats only seconds are skipped at the end of test
+        assert joiner.get(flush=True) == []
+        assert joiner.no_data == 7
+
+    def test_late_data(self):
+        clock = Clock()
+        joiner = StreamJoiner(5, clock)
+        joiner.add_stats(stats(1))
+        clock.now = 6
+        assert joiner.get() == []
+        assert joiner.no_data == 1
+        assert not joiner.add_data(data(1))
+        assert joiner.late_data == 1
+
+    def test_no_data_listener(self):
+        """
+        Seconds with stats only don't reach listeners that divide by
+        sample count
+        """
+
+        class Autostop(object):
+            def add_counting(self, criterion):
+                pass
+
+        criterion = AvgTimeCriterion(Autostop(), '100ms, 2s')
+        joiner = StreamJoiner(5)
+        joiner.add_stats(stats(100))
+        joiner.add_stats(stats(101))
+        joiner.add_data({
+            'ts': 101,
+            'overall': {'interval_real': {'total': 300000, 'len': 2}}
+        })
+        pairs = joiner.get(flush=True)
+        assert [d['ts'] for d, _ in pairs] == [101]
+        for data_item, stat_item in pairs:
+            criterion.notify(data_item, stat_item)
+        assert criterion.seconds_count == 1
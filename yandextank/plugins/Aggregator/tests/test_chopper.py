@@ -1,10 +1,28 @@
+import json
+from StringIO import StringIO
+
 import pandas as pd
 import numpy as np
+from pkg_resources import resource_string
 
-from yandextank.plugins.Aggregator.chopper import TimeChopper
+from yandextank.plugins.Aggregator.aggregator import Late, Worker, phout_columns
+from yandextank.plugins.Aggregator.chopper import TimeChopper, AccumulatingChopper, \
+    ParallelChopper, WatermarkChopper
+from yandextank.plugins.Aggregator.tags import registry
 
 from conftest import MAX_TS, random_split
 
+AGGR_CONFIG = json.loads(
+    resource_string("yandextank.plugins.Aggregator", 'config/phout.json')
+    .decode('utf-8'))
+
+
+def csv_to_df(data):
+    """ parser for ParallelChopper tests, like readers do """
+    df = pd.read_csv(StringIO(data), names=phout_columns, index_col=0)
+    df['tag'] = registry.encode(df['tag'])
+    return df
+
 
 class TestChopper(object):
     def test_one_chunk(self, data):
@@ -34,3 +52,123 @@ class TestChopper(object):
         assert len(data) == len(concatinated), "We did not lose anything"
         assert np.allclose(
             concatinated.values, data.values), "We did not corrupt the data"
+
+
+class TestAccumulatingChopper(object):
+    def test_multiple_chunks(self, data):
+        worker = Worker(AGGR_CONFIG, False)
+        chunks = list(random_split(data))
+        chunks[5], chunks[6] = chunks[6], chunks[5]
+        chopper = AccumulatingChopper(chunks, worker, 5)
+        result = list(chopper)
+        assert len(result) == MAX_TS
+        assert [ts for ts, _ in result] == sorted(set(data.index))
+        total = sum(
+            acc.overall()['interval_real']['len'] for _, acc in result)
+        assert total == len(data), "We did not lose anything"
+
+    def test_same_as_dataframe(self, data):
+        worker = Worker(AGGR_CONFIG, False)
+        chunks = list(random_split(data))
+        expected = dict(TimeChopper(chunks, 5))
+        for ts, acc in AccumulatingChopper(chunks, worker, 5):
+            df = expected[ts]
+            overall = worker.finalize(acc.overall())
+            aggregated = worker.aggregate(df)
+            for key in ['total', 'min', 'max', 'len', 'hist']:
+                assert overall['interval_real'][key] == \
+                    aggregated['interval_real'][key]
+            assert overall['net_code'] == aggregated['net_code']
+            assert overall['interval_real']['q']['value'][-1] == \
+                df.interval_real.max()
+            assert set(acc.tagged) == set(df.tag)
+
+    def overall_len(self, acc):
+        return acc.overall()['interval_real']['len']
+
+    def test_late_samples(self, data):
+        worker = Worker(AGGR_CONFIG, False)
+        chopper = AccumulatingChopper(
+            split_with_late_chunk(data), worker, 5, max_lateness=3)
+        result = list(chopper)
+        corrections = [(ts, c) for ts, c in result if isinstance(c, Late)]
+        passed = [ts for ts, c in result if not isinstance(c, Late)]
+        assert passed == sorted(set(passed)), "Every second is passed once"
+        assert corrections
+        assert chopper.late_samples == sum(
+            self.overall_len(c.data) for _, c in corrections)
+        assert chopper.late_samples + sum(
+            self.overall_len(c) for _, c in result
+            if not isinstance(c, Late)) == len(data)
+
+    def test_cache_size_late_samples(self, data):
+        worker = Worker(AGGR_CONFIG, False)
+        chopper = AccumulatingChopper(
+            split_with_late_chunk(data), worker, 5, drop_late=True)
+        result = list(chopper)
+        assert not any(isinstance(c, Late) for _, c in result)
+        passed = [ts for ts, _ in result]
+        assert passed == sorted(set(passed)), "Every second is passed once"
+        assert chopper.late_samples > 0
+        assert sum(self.overall_len(c) for _, c in result) + \
+            chopper.late_samples == len(data)
+
+
+def split_with_late_chunk(df, size=500):
+    """ chunk with the oldest samples comes in the middle """
+    chunks = [df.iloc[i:i + size] for i in range(0, len(df), size)]
+    chunks.insert(len(chunks) // 2, chunks.pop(0))
+    return chunks
+
+
+class TestWatermarkChopper(object):
+    def test_partially_reversed_data(self, data):
+        chunks = [data.iloc[i:i + 500] for i in range(0, len(data), 500)]
+        chunks[5], chunks[6] = chunks[6], chunks[5]
+        chopper = WatermarkChopper(chunks, 100)
+        result = list(chopper)
+        assert [ts for ts, _ in result] == sorted(set(data.index))
+        concatinated = pd.concat(r[1] for r in result)
+        assert np.array_equal(
+            concatinated.groupby(level=0).sum().values,
+            data.groupby(level=0).sum().values), "We did not corrupt the data"
+        assert chopper.late_samples == 0
+
+    def test_late_samples(self, data):
+        chopper = WatermarkChopper(split_with_late_chunk(data), 3)
+        result = list(chopper)
+        corrections = [(ts, c) for ts, c in result if isinstance(c, Late)]
+        passed = [ts for ts, c in result if not isinstance(c, Late)]
+        assert passed == sorted(set(passed)), "Every second is passed once"
+        assert corrections
+        assert all(ts < passed[-1] for ts, _ in corrections)
+        assert chopper.late_samples == sum(len(c.data) for _, c in corrections)
+        assert chopper.late_samples + sum(
+            len(c) for _, c in result if not isinstance(c, Late)) == len(data)
+
+    def test_drop_late(self, data):
+        chopper = WatermarkChopper(
+            split_with_late_chunk(data), 3, drop_late=True)
+        result = list(chopper)
+        assert not any(isinstance(c, Late) for _, c in result)
+        assert chopper.late_samples > 0
+        assert sum(len(c) for _, c in result) + \
+            chopper.late_samples == len(data)
+
+
+class TestParallelChopper(object):
+    def test_same_as_accumulating(self, data):
+        worker = Worker(AGGR_CONFIG, False)
+        raw = data.assign(tag=data.tag.map(registry.name))
+        chunks = [
+            raw.iloc[i:i + 3000].to_csv(header=False)
+            for i in range(0, len(raw), 3000)]
+        result = list(
+            ParallelChopper(chunks, worker, csv_to_df, 2, cache_size=5))
+        expected = list(AccumulatingChopper([data], worker, 5))
+        assert [ts for ts, _ in result] == [ts for ts, _ in expected]
+        for (_, acc), (_, expected_acc) in zip(result, expected):
+            assert worker.finalize(acc.overall()) == \
+                worker.finalize(expected_acc.overall())
+            assert set(acc.tagged) == set(
+                registry.name(tag) for tag in expected_acc.tagged)
@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+
+from yandextank.plugins.Aggregator.histogram import (
+    BinnedHistogram, LogLinearHistogram, get_histogram, merge, verbose_bins)
+
+
+class TestBinnedHistogram(object):
+    def test_same_as_numpy(self):
+        bins = np.array([0, 10, 20, 50, 100])
+        values = np.array([0, 5, 10, 19, 20, 99, 100, 101, 1000])
+        ids, counts = BinnedHistogram(bins).counts(values)
+        expected, _ = np.histogram(values, bins=bins)
+        assert counts[ids < len(bins) - 1].tolist() == \
+            expected[expected > 0].tolist()
+        assert ids[-1] == len(bins) - 1, "overflow bucket"
+        assert counts[-1] == 2
+
+    @pytest.mark.parametrize('bins', [
+        verbose_bins(),
+        np.array([0, 1, 2, 3, 10, 20, 30, 100, 150, 200, 1000]) * 1000,
+        np.array([5, 7, 9, 30, 31, 100]),
+        np.array([0.5, 1.5, 3]),  # not integers, binary search
+    ])
+    def test_lookup(self, bins):
+        hist = BinnedHistogram(bins)
+        edges = bins.astype(np.int64)
+        values = np.concatenate([
+            np.random.randint(-10, edges[-1] * 2, 100000), edges, edges - 1,
+            edges + 1, [-2**40, 2**40]])
+        expected = np.searchsorted(bins, values, side='right') - 1
+        expected[values == bins[-1]] = len(bins) - 2
+        assert hist.index(values).tolist() == expected.tolist()
+        ids, counts = hist.counts(values)
+        assert counts.sum() == (expected >= 0).sum()
+
+    def test_lookup_size(self):
+        assert len(BinnedHistogram(verbose_bins()).lookup[2]) < 100000
+
+
+class TestLogLinearHistogram(object):
+    @pytest.mark.parametrize('digits', [1, 2, 3])
+    def test_precision(self, digits):
+        hist = LogLinearHistogram(digits)
+        values = np.unique(
+            np.random.lognormal(8, 3, 10000).astype(np.int64))
+        idx = hist.index(values)
+        assert np.all(np.diff(idx) >= 0), "buckets are ordered"
+        upper = hist.upper(idx)
+        assert np.all(upper >= values)
+        assert np.all((upper - values) <= values / 10.0**digits)
+
+    def test_small_values_are_exact(self):
+        hist = LogLinearHistogram(2)
+        values = np.arange(hist.sub_bucket_count)
+        assert hist.upper(hist.index(values)).tolist() == values.tolist()
+
+    def test_bucket_bounds(self):
+        hist = LogLinearHistogram(2)
+        values = np.arange(1, 100000)
+        idx = hist.index(values)
+        boundaries = np.nonzero(np.diff(idx))[0]
+        # last value in a bucket is its upper bound
+        assert hist.upper(idx[boundaries]).tolist() == \
+            values[boundaries].tolist()
+
+    def test_fixed_size(self):
+        hist = LogLinearHistogram(2)
+        assert hist.index(np.array([2**62]))[0] < 8000
+
+
+@pytest.mark.parametrize('backend', ['verbose', 'log_linear'])
+def test_quantiles(backend):
+    hist = get_histogram(backend, 3)
+    values = np.random.randint(1000, 100000, 50000)
+    percentiles = np.array([50, 75, 90, 95, 99, 100])
+    half = len(values) // 2
+    counts = merge(hist.counts(values[:half]), hist.counts(values[half:]))
+    quantiles = hist.quantiles(
+        counts, percentiles, values.min(), values.max())
+    exact = np.percentile(values, percentiles)
+    assert np.allclose(quantiles, exact, rtol=0.01)
+    assert quantiles[-1] == values.max()
+
+
+def test_group_counts():
+    hist = BinnedHistogram(verbose_bins())
+    values = np.random.randint(0, 10**6, 1000)
+    codes = np.random.randint(0, 5, 1000)
+    for group, (ids, counts) in enumerate(hist.group_counts(values, codes, 5)):
+        expected_ids, expected_counts = hist.counts(values[codes == group])
+        assert ids.tolist() == expected_ids.tolist()
+        assert counts.tolist() == expected_counts.tolist()
@@ -0,0 +1,18 @@
+import time
+
+from yandextank.plugins.Aggregator import instrumentation
+
+
+class TestSnapshot(object):
+    def test_stages(self):
+        snapshot = instrumentation.Snapshot()
+        snapshot.last_time = time.time() - 2
+        instrumentation.parse.add(0.5, 1000)
+        instrumentation.results_queue.set(3)
+        result = snapshot.get()
+        parse = result['stages']['parse']
+        assert 0.2 < parse['load'] <= 0.25
+        assert 450 < parse['rows_per_second'] <= 500
+        assert result['queues']['results'] == 3
+        # only what was recorded since the previous snapshot is counted
+        assert snapshot.get()['stages']['parse']['rows_per_second'] == 0
@@ -1,4 +1,5 @@
 import json
+import time
 
 import numpy as np
 from conftest import MAX_TS, random_split
@@ -50,3 +51,25 @@ class TestPipeline(object):
         drain = Drain(pipeline, results_queue)
         drain.run()
         assert results_queue.qsize() == MAX_TS
+
+
+class WaitingSource(object):
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.waits = 0
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def wait(self, timeout):
+        self.waits += 1
+        return False
+
+
+class TestDataPoller(object):
+    def test_no_sleep_with_backlog(self):
+        source = WaitingSource([1, 2, None, 3, None])
+        start = time.time()
+        assert list(DataPoller(source, poll_period=10)) == [1, 2, 3]
+        assert source.waits == 2
+        assert time.time() - start < 1
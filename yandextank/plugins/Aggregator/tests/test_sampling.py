@@ -0,0 +1,84 @@
+import json
+
+import numpy as np
+import pandas as pd
+from pkg_resources import resource_string
+
+from conftest import MAX_TS, random_split
+from yandextank.plugins.Aggregator.aggregator import Aggregator, Worker
+from yandextank.plugins.Aggregator.chopper import TimeChopper
+from yandextank.plugins.Aggregator.sampling import AdaptiveSampler
+
+AGGR_CONFIG = json.loads(
+    resource_string("yandextank.plugins.Aggregator", 'config/phout.json')
+    .decode('utf-8'))
+
+
+class Clock(object):
+    def __init__(self):
+        self.spent = 0
+
+    def __call__(self):
+        return self.spent
+
+
+class FixedStep(object):
+    def __init__(self, step):
+        self.step = step
+        self.rate = 1.0 / step
+
+    def tick(self):
+        pass
+
+
+class TestAdaptiveSampler(object):
+    def test_adapts(self):
+        clock = Clock()
+        sampler = AdaptiveSampler(0.1, max_step=8, smoothing=1, clock=clock)
+        steps = []
+        for cost in [0.3, 0.3, 0.3, 0.3, 0.08, 0.04, 0.04, 0.04]:
+            clock.spent += cost
+            sampler.tick()
+            steps.append(sampler.step)
+        assert steps == [2, 4, 8, 8, 8, 4, 2, 1]
+        assert sampler.rate == 1.0
+
+
+class TestSampledWorker(object):
+    def test_exact_counters(self, data):
+        exact = Worker(AGGR_CONFIG, False)
+        sampled = Worker(AGGR_CONFIG, False, sampler=FixedStep(4))
+        expected = exact.finalize(exact.fold(data))
+        result = sampled.finalize(sampled.fold(data))
+        for key in AGGR_CONFIG:
+            for aggregate in ['len', 'total', 'min', 'max', 'count']:
+                if aggregate in AGGR_CONFIG[key]:
+                    assert result[key][aggregate] == \
+                        expected[key][aggregate]
+        hist = result['interval_real']['hist']['data']
+        assert sum(hist) == len(data)
+        assert np.allclose(
+            result['interval_real']['q']['value'],
+            expected['interval_real']['q']['value'], rtol=0.1, atol=20)
+
+    def test_fold_groups(self, data):
+        sampled = Worker(AGGR_CONFIG, False, sampler=FixedStep(7))
+        codes, tags = pd.factorize(data.tag)
+        partials = sampled.fold_groups(data, codes, len(tags))
+        for tag, partial in zip(tags, partials):
+            tagged = data[data.tag == tag]
+            expected = sampled.fold(tagged)
+            # the same samples are taken from a tag whatever way it's folded
+            assert sampled.finalize(partial) == sampled.finalize(expected)
+            assert sum(partial['interval_real']['hist'][1]) == \
+                7 * ((len(tagged) + 6) // 7)
+
+
+class TestSampledAggregator(object):
+    def test_sample_rate(self, data):
+        pipeline = Aggregator(
+            TimeChopper(random_split(data), cache_size=3), AGGR_CONFIG,
+            False, vectorized=True, sampler=FixedStep(2))
+        results = list(pipeline)
+        assert len(results) == MAX_TS
+        assert all(result.sample_rate == 0.5 for result in results)
@@ -0,0 +1,26 @@
+import numpy as np
+
+from yandextank.plugins.Aggregator.tags import TagRegistry, UNTAGGED
+
+
+class TestTagRegistry(object):
+    def test_encode(self):
+        tags = TagRegistry()
+        ids = tags.encode(['a', 'b#1', None, 'a', 'b#2', np.nan])
+        assert list(ids) == [0, 1, UNTAGGED, 0, 2, UNTAGGED]
+        assert [tags.name(tag_id) for tag_id in ids] == \
+            ['a', 'b#1', None, 'a', 'b#2', None]
+
+    def test_strip_marker(self):
+        tags = TagRegistry()
+        ids = tags.encode(['case#1', 'case#2', 'other', 'x#y#3'], True)
+        assert list(ids) == [0, 0, 1, 2]
+        assert tags.names == ['case', 'other', 'x#y']
+
+    def test_stable_ids(self):
+        tags = TagRegistry()
+        first = tags.encode(['b', 'a'])
+        second = tags.encode(['a', 'c', 'b'])
+        assert list(first) == [0, 1]
+        assert list(second) == [1, 2, 0]
+        assert tags.name('not interned') == 'not interned'
@@ -0,0 +1,33 @@
+from ...common.interfaces import AbstractInfoWidget
+
+
+class AggregatorInfoWidget(AbstractInfoWidget):
+    """
+    Widget with aggregation pipeline load, shows when the tank itself
+    is the bottleneck
+    """
+
+    def get_index(self):
+        return 20
+
+    def __init__(self, sender):
+        AbstractInfoWidget.__init__(self)
+        self.owner = sender
+
+    def render(self, screen):
+        info = self.owner.instrumentation_data
+        if not info:
+            return ''
+        res = "Aggregator:"
+        for name, stage in sorted(info['stages'].items()):
+            load = '%6.1f%%' % (stage['load'] * 100)
+            if stage['load'] > 0.8:
+                load = screen.markup.RED + load + screen.markup.RESET
+            elif stage['load'] > 0.5:
+                load = screen.markup.YELLOW + load + screen.markup.RESET
+            res += "\n  %9s: %s %8d rows/s" % (
+                name, load, stage['rows_per_second'])
+        res += "\n  Queues: results %s, stats %s" % (
+            info['queues']['results'], info['queues']['stats'])
+        res += "\n  Lag: %ss" % info['lag']
+        return res
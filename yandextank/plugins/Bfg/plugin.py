@@ -5,7 +5,7 @@ import pip
 from ...common.interfaces import AbstractPlugin, GeneratorPlugin
 
 from .guns import LogGun, SqlGun, CustomGun, HttpGun, ScenarioGun, UltimateGun
-from .reader import BfgReader, BfgStatsReader
+from .reader import BfgReader, BfgBinReader, BfgStatsReader
 from .widgets import BfgInfoWidget
 from .worker import BFGMultiprocessing, BFGGreen
 from ..Aggregator import Plugin as AggregatorPlugin
@@ -40,12 +40,14 @@ class Plugin(AbstractPlugin, GeneratorPlugin):
 
     def get_available_options(self):
         return [
-            "gun_type", "instances", "cached_stpd", "pip"
+            "gun_type", "instances", "cached_stpd", "pip", "phout_bin",
+            "binary_stpd"
         ] + self.stepper_wrapper.get_available_options
 
     def configure(self):
         self.log.info("Configuring BFG...")
         self.stepper_wrapper.read_config()
+        self.stepper_wrapper.binary_stpd = self.get_option("binary_stpd")
 
     def prepare_test(self):
         pip_deps = self.get_option("pip", "").splitlines()
@@ -85,7 +87,12 @@ class Plugin(AbstractPlugin, GeneratorPlugin):
             self.log.warning("No aggregator found: %s", ex)
 
         if aggregator:
-            aggregator.reader = BfgReader(self.bfg.results)
+            if self.get_option("phout_bin"):
+                phout_bin = self.core.mkstemp(".bin", "phout_")
+                self.core.add_artifact_file(phout_bin)
+                aggregator.reader = BfgBinReader(self.bfg.results, phout_bin)
+            else:
+                aggregator.reader = BfgReader(self.bfg.results)
             aggregator.stats_reader = BfgStatsReader(
                 self.bfg.instance_counter, self.stepper_wrapper.steps)
 
@@ -5,16 +5,23 @@ from queue import Empty
 from threading import Lock
 import threading as th
 import logging
+
+from ..Aggregator import instrumentation
+from ..Aggregator.tags import registry
+from ..Phantom.phout_bin import PhoutBinReader, PhoutBinWriter
+
 logger = logging.getLogger(__name__)
 
 
 def records_to_df(records):
+    start_time = time.time()
     records = pd.DataFrame.from_records(records)
     records['receive_ts'] = records['send_ts'] + records['interval_real'] / 1e6
     records['receive_sec'] = records.receive_ts.astype(int)
     # TODO: consider configuration for the following:
-    records['tag'] = records.tag.str.rsplit('#', 1, expand=True)[0]
+    records['tag'] = registry.encode(records.tag, strip_marker=True)
     records.set_index(['receive_sec'], inplace=True)
+    instrumentation.parse.add(time.time() - start_time, len(records))
     return records
 
 
@@ -59,6 +66,51 @@ class BfgReader(object):
         self.closed = True
 
 
+class BfgBinReader(object):
+    """
+    Results of guns are saved to binary phout in a thread as they come and
+    aggregator reads them back with PhoutBinReader, so that the binary
+    phout is the source of aggregated data, like phout is for phantom
+    """
+
+    def __init__(self, results, phout_bin):
+        self.results = results
+        self.closed = False
+        self.writer = PhoutBinWriter(phout_bin)
+        self.reader = PhoutBinReader(phout_bin)
+        self.thread = th.Thread(target=self._write)
+        self.thread.start()
+
+    def _write(self):
+        while True:
+            # results that came before close are all saved
+            closed = self.closed
+            records = []
+            try:
+                while True:
+                    records.append(self.results.get(block=False))
+            except Empty:
+                pass
+            if records:
+                self.writer.write(pd.DataFrame.from_records(records))
+            if closed:
+                break
+            if not records:
+                time.sleep(0.1)
+        self.writer.close()
+
+    def __iter__(self):
+        return iter(self.reader)
+
+    def wait(self, timeout):
+        return self.reader.wait(timeout)
+
+    def close(self):
+        self.closed = True
+        self.thread.join()
+        self.reader.close()
+
+
 class BfgStatsReader(object):
     def __init__(self, instance_counter, steps):
         self.closed = False
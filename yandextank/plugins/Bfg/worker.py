@@ -4,7 +4,7 @@ import threading as th
 import multiprocessing as mp
 from queue import Empty, Full
 
-from ...stepper import StpdReader
+from ...stepper import stpd_reader
 
 logger = logging.getLogger(__name__)
 
@@ -82,7 +82,7 @@ Gun: {gun.__class__.__name__}
         """
         A feeder that runs in distinct thread in main process.
         """
-        self.plan = StpdReader(self.stpd_filename)
+        self.plan = stpd_reader(self.stpd_filename)
         if self.cached_stpd:
             self.plan = list(self.plan)
         for task in self.plan:
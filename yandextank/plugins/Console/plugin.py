@@ -8,6 +8,7 @@ from ...common.interfaces import AbstractPlugin, AggregateResultListener
 
 from .screen import Screen
 from ..Aggregator import Plugin as AggregatorPlugin
+from ..Aggregator.widget import AggregatorInfoWidget
 
 LOG = logging.getLogger(__name__)
 
@@ -53,6 +54,7 @@ class Plugin(AbstractPlugin, AggregateResultListener):
         try:
             aggregator = self.core.get_plugin_of_type(AggregatorPlugin)
             aggregator.add_result_listener(self)
+            self.add_info_widget(AggregatorInfoWidget(aggregator))
         except KeyError:
             LOG.debug("No aggregator for console")
             self.screen.block_rows = []
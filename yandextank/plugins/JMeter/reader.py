@@ -3,10 +3,12 @@ import pandas as pd
 import numpy as np
 import queue as q
 import logging
+import time
 from StringIO import StringIO
 
-from ..Aggregator import aggregator as agg
-from ..Aggregator.chopper import TimeChopper
+from ...common.util import FileFollower
+from ..Aggregator import instrumentation
+from ..Aggregator.tags import registry
 
 logger = logging.getLogger(__name__)
 
@@ -31,7 +33,17 @@ KNOWN_EXC = {
 }
 
 
-def _exc_to_net(param1, success):
+def _log_once(logged, level, message, param1):
+    """
+    Strange codes come in every chunk, they are logged once each for a
+    reader, logged is a set of codes logged by it
+    """
+    if param1 not in logged:
+        logged.add(param1)
+        logger.log(level, message, param1)
+
+
+def _exc_to_net(param1, success, logged):
     """ translate http code to net code. if accertion failed, set net code to 314 """
     if len(param1) <= 3:
         # FIXME: we're unable to use better logic here, because we should support non-http codes
@@ -46,33 +58,46 @@ def _exc_to_net(param1, success):
     if exc in KNOWN_EXC.keys():
         return KNOWN_EXC[exc]
     else:
-        logger.warning(
+        _log_once(
+            logged, logging.WARNING,
             "Unknown Java exception, consider adding it to dictionary: %s",
             param1)
         return 41
 
 
-def _exc_to_http(param1):
+def _exc_to_http(param1, logged):
     """ translate exception str to http code"""
     if len(param1) <= 3:
         try:
             int(param1)
-        except:
-            logger.error(
-                "JMeter wrote some strange data into codes column: %s", param1)
+        except ValueError:
+            _log_once(
+                logged, logging.ERROR,
+                "JMeter wrote some strange data into codes column: %s",
+                param1)
         else:
             return int(param1)
 
-    exc = param1.split(' ')[-1]
-    if exc in KNOWN_EXC.keys():
-        return 0
-    else:
-        logger.warning("Unknown Java exception. %s", param1)
-        return 0
+    return 0
 
 
-exc_to_net = np.vectorize(_exc_to_net)
-exc_to_http = np.vectorize(_exc_to_http)
+def retcodes_to_codes(retcodes, success, logged=None):
+    """
+    Net and http codes for retcode and success columns. Every distinct
+    retcode is translated once, codes of short (http) retcodes depend on
+    success. Strange codes already in logged set are not logged again
+    """
+    logged = set() if logged is None else logged
+    codes, uniques = pd.factorize(retcodes.fillna(''))
+    short = np.array([len(code) <= 3 for code in uniques] + [True])
+    net = np.array(
+        [_exc_to_net(code, True, logged) for code in uniques] + [0], dtype=np.int64)
+    http = np.array(
+        [_exc_to_http(code, logged) for code in uniques] + [0], dtype=np.int64)
+    net_code = np.where(
+        short[codes], np.where(success, 0, 314), net[codes])
+    return net_code, http[codes]
+
 
 # phout_columns = [
 #     'send_ts', 'tag', 'interval_real', 'connect_time', 'send_time', 'latency',
@@ -98,81 +123,100 @@ jtl_types = {
 }
 
 
-def fix_latency(row):
-    if row['latency'] < row['connect_time']:
-        if row['interval_real'] < row['connect_time']:
-            latency = 0
-        else:
-            latency = row['interval_real'] - row['connect_time']
-    else:
-        latency = row['latency'] - row['connect_time']
-    return latency
+def fix_latency(latency, connect_time, interval_real):
+    """
+    Latency without connect time, JMeter latency includes it
+    """
+    return np.where(
+        latency < connect_time,
+        np.where(
+            interval_real < connect_time, 0, interval_real - connect_time),
+        latency - connect_time)
 
 
 # timeStamp,elapsed,label,responseCode,success,bytes,grpThreads,allThreads,Latency
-def string_to_df(data):
+def string_to_df(data, logged=None):
+    start_time = time.time()
     chunk = pd.read_csv(
         StringIO(data), sep='\t', names=jtl_columns, dtype=jtl_types)
     chunk["receive_ts"] = (chunk["send_ts"] + chunk['interval_real']) / 1000.0
     chunk['receive_sec'] = chunk["receive_ts"].astype(np.int64)
     chunk['interval_real'] = chunk["interval_real"] * 1000  # convert to µs
     chunk.set_index(['receive_sec'], inplace=True)
+    chunk['tag'] = registry.encode(chunk['tag'])
     l = len(chunk)
     chunk['connect_time'] = (chunk['connect_time'].fillna(0) *
                              1000).astype(np.int64)
-    chunk['latency'] = chunk['latency'] * 1000
-    chunk['latency'] = chunk.apply(fix_latency, axis=1)
+    chunk['latency'] = fix_latency(
+        chunk['latency'].values * 1000, chunk['connect_time'].values,
+        chunk['interval_real'].values)
     chunk['send_time'] = np.zeros(l)
     chunk['receive_time'] = chunk['interval_real'] - \
         chunk['latency'] - chunk['connect_time']
     chunk['interval_event'] = np.zeros(l)
     chunk['size_out'] = np.zeros(l).astype(int)
-    chunk['net_code'] = exc_to_net(chunk['retcode'], chunk['success'])
-    chunk['proto_code'] = exc_to_http(chunk['retcode'])
+    chunk['net_code'], chunk['proto_code'] = retcodes_to_codes(
+        chunk['retcode'], chunk['success'].values, logged)
+    instrumentation.parse.add(time.time() - start_time, l)
     return chunk
 
 
 class JMeterStatAggregator(object):
-    def __init__(self, source):
-        self.worker = agg.Worker({"allThreads": ["max"]}, False)
-        self.source = source
+    """
+    Per second max of allThreads. Reader adds maxima of every chunk it
+    parses, so chunks are not chopped and aggregated once more for stats.
+    A second is passed when there are more than cache_size newer ones
+    """
+
+    def __init__(self, cache_size=3):
+        self.cache_size = cache_size
+        self.maxima = q.Queue()
+        self.threads = {}
+        self.closed = False
 
-    def __iter__(self):
-        for ts, chunk in self.source:
-            stats = self.worker.aggregate(chunk)
-            yield [{
-                'ts': ts,
+    def add(self, chunk):
+        self.maxima.put(chunk['allThreads'].groupby(level=0).max())
+
+    def _get_stats(self, flush=False):
+        while True:
+            try:
+                maxima = self.maxima.get_nowait()
+            except q.Empty:
+                break
+            for ts, threads in maxima.items():
+                self.threads[ts] = max(self.threads.get(ts, threads), threads)
+        stats = []
+        while self.threads and (flush or len(self.threads) > self.cache_size):
+            ts = min(self.threads)
+            stats.append({
+                'ts': int(ts),
                 'metrics': {
-                    'instances': stats['allThreads']['max'],
+                    'instances': int(self.threads.pop(ts)),
                     'reqps': 0
                 }
-            }]
+            })
+        return stats or None
+
+    def __iter__(self):
+        while not self.closed:
+            yield self._get_stats()
+        yield self._get_stats(flush=True)
 
     def close(self):
-        pass
+        self.closed = True
 
 
 class JMeterReader(object):
     def __init__(self, filename):
         self.buffer = ""
-        self.stat_buffer = ""
         self.jtl_file = filename
+        self.jtl = None
         self.jmeter_finished = False
         self.agg_finished = False
         self.closed = False
-        self.stat_queue = q.Queue()
-        self.stats_reader = JMeterStatAggregator(
-            TimeChopper(self._read_stat_queue(), 3))
-
-    def _read_stat_queue(self):
-        while not self.closed:
-            for _ in range(self.stat_queue.qsize()):
-                try:
-                    si = self.stat_queue.get_nowait()
-                    if si is not None:
-                        yield si
-                except q.Empty:
-                    break
+        self.stats_reader = JMeterStatAggregator()
+        # strange codes logged
+        self.logged = set()
 
     def _read_jtl_chunk(self, jtl):
         data = jtl.read(1024 * 1024 * 10)
@@ -181,22 +225,27 @@ class JMeterReader(object):
             if len(parts) > 1:
                 ready_chunk = self.buffer + parts[0] + '\n'
                 self.buffer = parts[1]
-                df = string_to_df(ready_chunk)
-                self.stat_queue.put(df)
+                df = string_to_df(ready_chunk, self.logged)
+                self.stats_reader.add(df)
                 return df
             else:
                 self.buffer += parts[0]
         else:
             if self.jmeter_finished:
                 self.agg_finished = True
-            jtl.readline()
         return None
 
     def __iter__(self):
-        with open(self.jtl_file, 'r') as jtl:
+        self.jtl = FileFollower(self.jtl_file)
+        try:
             while not self.closed:
-                yield self._read_jtl_chunk(jtl)
-            yield self._read_jtl_chunk(jtl)
+                yield self._read_jtl_chunk(self.jtl)
+            yield self._read_jtl_chunk(self.jtl)
+        finally:
+            self.jtl.close()
+
+    def wait(self, timeout):
+        return self.jtl.wait(timeout)
 
     def close(self):
         self.closed = True
@@ -0,0 +1,69 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+from yandextank.plugins.JMeter.reader import JMeterReader, fix_latency, \
+    retcodes_to_codes
+
+
+def test_fix_latency():
+    latency = fix_latency(
+        np.array([500, 100, 100]), np.array([200, 200, 300]),
+        np.array([1000, 1000, 200]))
+    assert latency.tolist() == [300, 800, 0]
+
+
+def test_retcodes_to_codes(caplog):
+    retcodes = pd.Series([
+        '200', '404', 'Non HTTP response code: java.net.ConnectException',
+        'Non HTTP response code: java.lang.Strange', '200',
+        'Non HTTP response code: java.lang.Strange', 'abc', None
+    ])
+    success = np.array([True, False, False, False, False, False, True, True])
+    logged = set()
+    with caplog.at_level(logging.WARNING):
+        net_code, proto_code = retcodes_to_codes(retcodes, success, logged)
+        # the next chunk of the same reader
+        retcodes_to_codes(retcodes, success, logged)
+    assert net_code.tolist() == [0, 314, 110, 41, 314, 41, 0, 0]
+    assert proto_code.tolist() == [200, 404, 0, 0, 200, 0, 0, 0]
+    assert sum(
+        'java.lang.Strange' in record.getMessage()
+        for record in caplog.records) == 1
+    # another reader logs it again
+    with caplog.at_level(logging.WARNING):
+        retcodes_to_codes(retcodes, success, set())
+    assert sum(
+        'java.lang.Strange' in record.getMessage()
+        for record in caplog.records) == 2
+
+
+def test_stats(tmpdir):
+    jtl = tmpdir.join('jmeter.jtl')
+    # timeStamp, elapsed, label, responseCode, success, bytes, grpThreads,
+    # allThreads, Latency, Connect
+    samples = [(1482159938000 + 250 * i, i % 7) for i in range(40)]
+    jtl.write(''.join(
+        '%d\t100\ttag\t200\ttrue\t100\t1\t%d\t50\t10\n' % sample
+        for sample in samples))
+    expected = {}
+    for send_ts, threads in samples:
+        ts = (send_ts + 100) // 1000
+        expected[ts] = max(expected.get(ts, threads), threads)
+    reader = JMeterReader(str(jtl))
+    rows = 0
+    for chunk in reader:
+        if chunk is None:
+            reader.close()
+        else:
+            rows += len(chunk)
+    assert rows == 40
+    reader.stats_reader.close()
+    stats = [
+        item for items in reader.stats_reader if items is not None
+        for item in items
+    ]
+    assert [
+        (item['ts'], item['metrics']['instances']) for item in stats
+    ] == sorted(expected.items())
@@ -22,7 +22,7 @@ class Plugin(AbstractPlugin, AggregateResultListener, MonitoringDataListener):
         self._is_telegraf = None
 
     def get_available_options(self):
-        return ['monitoring_log', 'test_data_log']
+        return ['monitoring_log', 'test_data_log', 'cumulative_log']
 
     def configure(self):
         self.monitoring_stream = io.open(os.path.join(self.core.artifacts_dir,
@@ -44,6 +44,15 @@ class Plugin(AbstractPlugin, AggregateResultListener, MonitoringDataListener):
                 'stats': stats
             }))
 
+    def on_cumulative_data(self, data, final):
+        """
+        @data: whole-test aggregated data
+        """
+        if final:
+            with open(os.path.join(self.core.artifacts_dir,
+                                   self.get_option('cumulative_log')), 'w') as cumulative_log:
+                json.dump(data, cumulative_log)
+
     def monitoring_data(self, data_list):
         if self.is_telegraf:
             self.monitoring_stream.write('%s\n' % json.dumps(data_list))
@@ -0,0 +1,380 @@
+"""
+Throughput benchmarks for phout processing: parser, chopper, worker and the
+whole Aggregator pipeline are run on synthetic phout and compared with a
+stored baseline, so that performance regressions are found before release.
+
+    python -m yandextank.plugins.Phantom.benchmark --rows 1000000
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from pkg_resources import resource_string
+
+from ..Aggregator.aggregator import Aggregator, Worker
+from ..Aggregator.chopper import AccumulatingChopper, TimeChopper
+from .reader import string_to_df
+
+try:
+    import tracemalloc
+except ImportError:  # python 2
+    tracemalloc = None
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASELINE = os.path.join(
+    os.path.dirname(__file__), 'tests', 'benchmark_baseline.json')
+
+# microseconds
+LATENCY_DISTRIBUTIONS = {
+    'lognormal': lambda rnd, size: rnd.lognormal(np.log(10000), 1, size),
+    'exponential': lambda rnd, size: rnd.exponential(10000, size),
+    'uniform': lambda rnd, size: rnd.uniform(1000, 100000, size),
+}
+
+NET_ERRORS = [104, 110, 111]
+HTTP_ERRORS = [404, 500, 502, 503]
+
+
+def generate_phout(
+        rows,
+        rps=1000,
+        tags=10,
+        latency='lognormal',
+        net_errors=0.0,
+        http_errors=0.0,
+        start=1482159960,
+        seed=42):
+    """
+    Synthetic phout text. Requests are sent evenly at rps, tags are
+    distributed evenly (no tags at all if tags is 0), net_errors and
+    http_errors are shares of requests with network and http errors
+    """
+    if latency not in LATENCY_DISTRIBUTIONS:
+        raise ValueError('No such latency distribution: "%s"' % latency)
+    rnd = np.random.RandomState(seed)
+    interval_real = np.maximum(
+        LATENCY_DISTRIBUTIONS[latency](rnd, rows), 1).astype(np.int64)
+    connect_time = interval_real // 10
+    send_time = interval_real // 20
+    receive_time = interval_real // 20
+    net_code = np.zeros(rows, dtype=np.int64)
+    proto_code = np.full(rows, 200, dtype=np.int64)
+    errors = rnd.random_sample(rows)
+    http_failed = errors < http_errors
+    proto_code[http_failed] = rnd.choice(HTTP_ERRORS, http_failed.sum())
+    net_failed = errors > 1 - net_errors
+    net_code[net_failed] = rnd.choice(NET_ERRORS, net_failed.sum())
+    proto_code[net_failed] = 0
+    df = pd.DataFrame({
+        'send_ts': np.char.mod('%.3f', start + np.arange(rows) / float(rps)),
+        'tag': rnd.choice(['tag%d' % i for i in range(tags)], rows)
+        if tags else '',
+        'interval_real': interval_real,
+        'connect_time': connect_time,
+        'send_time': send_time,
+        'latency': interval_real - connect_time - send_time - receive_time,
+        'receive_time': receive_time,
+        'interval_event': interval_real - connect_time,
+        'size_out': rnd.randint(200, 400, rows),
+        'size_in': np.where(net_failed, 0, rnd.randint(1000, 10000, rows)),
+        'net_code': net_code,
+        'proto_code': proto_code,
+    })
+    return df.to_csv(
+        sep='\t', header=False, index=False, columns=[
+            'send_ts', 'tag', 'interval_real', 'connect_time', 'send_time',
+            'latency', 'receive_time', 'interval_event', 'size_out',
+            'size_in', 'net_code', 'proto_code'
+        ])
+
+
+def split_chunks(data, chunk_rows):
+    """
+    Chunks of complete lines, like PhantomReader reads them
+    """
+    lines = data.splitlines(True)
+    return [
+        ''.join(lines[i:i + chunk_rows])
+        for i in range(0, len(lines), chunk_rows)
+    ]
+
+
+def _consume(iterable):
+    for _ in iterable:
+        pass
+
+
+def maxrss_growth(func):
+    """
+    Growth of max resident set size of a forked child process while it
+    runs func, bytes. None when there is no fork or getrusage
+    """
+    if resource is None or not hasattr(os, 'fork'):
+        return None
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(read_fd)
+            # max rss of a child starts from rss of the parent at fork
+            before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            func()
+            after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # kilobytes on linux
+            os.write(write_fd, str((after - before) * 1024).encode('ascii'))
+        finally:
+            os._exit(0)
+    os.close(write_fd)
+    with os.fdopen(read_fd, 'rb') as result:
+        growth = result.read()
+    os.waitpid(pid, 0)
+    return int(growth) if growth else None
+
+
+def peak_memory(func):
+    """
+    Peak memory allocated while func runs, bytes: traced by tracemalloc or
+    growth of max rss of a child process where there is no tracemalloc
+    (python 2). The two are not comparable, see memory_method
+    """
+    if tracemalloc is None:
+        return maxrss_growth(func)
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def memory_method():
+    if tracemalloc is not None:
+        return 'tracemalloc'
+    if resource is not None and hasattr(os, 'fork'):
+        return 'maxrss'
+    return None
+
+
+def _cpu_model():
+    try:
+        with open('/proc/cpuinfo') as cpuinfo:
+            for line in cpuinfo:
+                if line.startswith('model name'):
+                    return line.split(':', 1)[1].strip()
+    except IOError:
+        pass
+    return platform.processor()
+
+
+def host_info():
+    """
+    Host and environment that results depend on, results are compared with
+    a baseline of the same host only
+    """
+    return {
+        'system': platform.system(),
+        'machine': platform.machine(),
+        'cpu': _cpu_model(),
+        'cpu_count': multiprocessing.cpu_count(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'memory_method': memory_method(),
+    }
+
+
+def measure(func, rows, repeat=3):
+    """
+    Best throughput of several runs of func, rows/s. Peak memory allocated
+    during a run is measured in a separate run, it is None when it can't be
+    measured
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start_time = time.time()
+        func()
+        best = min(best, time.time() - start_time)
+    return {
+        'rows_per_sec': rows / best if best > 0 else float('inf'),
+        'peak_memory': peak_memory(func),
+    }
+
+
+def run_benchmarks(data, chunk_rows=100000, repeat=3, names=None):
+    """
+    Benchmark results by name for phout text data
+    """
+    config = json.loads(
+        resource_string('yandextank.plugins.Aggregator', 'config/phout.json')
+        .decode('utf8'))
+    worker = Worker(config, False)
+    chunks = split_chunks(data, chunk_rows)
+    frames = [string_to_df(chunk) for chunk in chunks]
+    seconds = list(TimeChopper(iter(frames), cache_size=3))
+    rows = sum(len(frame) for frame in frames)
+
+    benchmarks = {
+        'string_to_df': lambda: [string_to_df(chunk) for chunk in chunks],
+        'time_chopper': lambda: _consume(
+            TimeChopper(iter(frames), cache_size=3)),
+        'worker_aggregate': lambda: [
+            worker.aggregate(df) for _, df in seconds],
+        'worker_fold': lambda: [worker.fold(df) for _, df in seconds],
+        'pipeline': lambda: _consume(Aggregator(
+            TimeChopper(
+                (string_to_df(chunk) for chunk in chunks), cache_size=3),
+            config, False)),
+        'pipeline_accumulating': lambda: _consume(Aggregator(
+            AccumulatingChopper(
+                (string_to_df(chunk) for chunk in chunks), worker,
+                cache_size=3),
+            config, False)),
+    }
+    results = {}
+    for name in sorted(benchmarks):
+        if names and name not in names:
+            continue
+        logger.info("Running %s", name)
+        results[name] = measure(benchmarks[name], rows, repeat)
+    return results
+
+
+def compare(results, baseline, tolerance=0.2):
+    """
+    Regression messages: throughput is less than baseline one or peak
+    memory is bigger than baseline one by more than tolerance
+    """
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+        expected = baseline[name]
+        if result['rows_per_sec'] < expected['rows_per_sec'] * (
+                1 - tolerance):
+            regressions.append(
+                '%s: %.0f rows/s, baseline %.0f rows/s' %
+                (name, result['rows_per_sec'], expected['rows_per_sec']))
+        if result['peak_memory'] is not None \
+                and expected.get('peak_memory') is not None \
+                and result['peak_memory'] > expected['peak_memory'] * (
+                    1 + tolerance):
+            regressions.append(
+                '%s: %d bytes peak memory, baseline %d bytes' %
+                (name, result['peak_memory'], expected['peak_memory']))
+    return regressions
+
+
+def load_baseline(filename, params, host):
+    """
+    Baseline results stored in filename, empty if there is no baseline or
+    it was measured on another host or environment, absolute throughput
+    of other hosts says nothing
+    """
+    if not os.path.exists(filename):
+        return {}
+    with open(filename) as baseline_file:
+        stored = json.load(baseline_file)
+    if stored.get('host') != host:
+        logger.warning(
+            "Baseline was measured on another host: %s, not comparing. "
+            "Save a baseline of this host with --save-baseline",
+            stored.get('host'))
+        return {}
+    if stored['params'] != params:
+        logger.warning(
+            "Baseline was measured with other params: %s", stored['params'])
+    return stored['results']
+
+
+def _format_memory(value):
+    if value is None:
+        return 'n/a'
+    return '%.1f MB' % (value / 1024.0 / 1024)
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    parser = argparse.ArgumentParser(
+        description='Benchmark phout processing on synthetic phout.')
+    parser.add_argument('--rows', default=1000000, type=int)
+    parser.add_argument('--rps', default=10000, type=int)
+    parser.add_argument('--tags', default=10, type=int)
+    parser.add_argument(
+        '--latency', default='lognormal',
+        choices=sorted(LATENCY_DISTRIBUTIONS))
+    parser.add_argument(
+        '--net-errors', default=0.01, type=float,
+        help='share of requests with network errors')
+    parser.add_argument(
+        '--http-errors', default=0.05, type=float,
+        help='share of requests with http errors')
+    parser.add_argument('--chunk-rows', default=100000, type=int)
+    parser.add_argument('--repeat', default=3, type=int)
+    parser.add_argument(
+        '--only', action='append', help='run only these benchmarks')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument(
+        '--save-baseline', action='store_true',
+        help='save results as a new baseline')
+    parser.add_argument(
+        '--tolerance', default=0.2, type=float,
+        help='allowed relative deviation from baseline')
+    args = parser.parse_args()
+
+    params = {
+        'rows': args.rows,
+        'rps': args.rps,
+        'tags': args.tags,
+        'latency': args.latency,
+        'net_errors': args.net_errors,
+        'http_errors': args.http_errors,
+        'chunk_rows': args.chunk_rows,
+    }
+    logger.info("Generating phout: %s", params)
+    data = generate_phout(
+        args.rows, args.rps, args.tags, args.latency, args.net_errors,
+        args.http_errors)
+    results = run_benchmarks(data, args.chunk_rows, args.repeat, args.only)
+    host = host_info()
+    baseline = {} if args.save_baseline else load_baseline(
+        args.baseline, params, host)
+
+    for name, result in sorted(results.items()):
+        line = '%-24s %12.0f rows/s %12s' % (
+            name, result['rows_per_sec'],
+            _format_memory(result['peak_memory']))
+        if name in baseline:
+            ratio = result['rows_per_sec'] / baseline[name]['rows_per_sec']
+            line += '  (%+.1f%% vs baseline)' % ((ratio - 1) * 100)
+        print(line)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(
+                {'params': params, 'host': host, 'results': results},
+                baseline_file,
+                indent=2, sort_keys=True)
+        logger.info("Baseline saved to %s", args.baseline)
+        return
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        logger.error("Regression: %s", regression)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
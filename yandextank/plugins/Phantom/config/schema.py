@@ -100,6 +100,10 @@ OPTIONS = {
         'type': 'string',
         'default': 'method_stream'
     },
+    'mmap_reader': {
+        'type': 'boolean',
+        'default': False
+    },
     'phantom_http_entity': {
         'type': 'string',
         'default': ''
@@ -154,6 +158,10 @@ OPTIONS = {
         'type': 'boolean',
         'default': False
     },
+    'stepper_workers': {
+        'type': 'integer',
+        'default': 0
+    },
     "threads": {
         "type": "integer",
         "default": None,
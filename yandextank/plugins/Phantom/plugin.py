@@ -9,7 +9,7 @@ import time
 from ...common.util import execute, expand_to_seconds
 from ...common.interfaces import AbstractPlugin, AbstractCriterion, GeneratorPlugin
 
-from .reader import PhantomReader, PhantomStatsReader
+from .reader import PhantomReader, PhantomMmapReader, PhantomStatsReader
 from .utils import PhantomConfig
 from .widget import PhantomInfoWidget, PhantomProgressBarWidget
 from ..Aggregator import Plugin as AggregatorPlugin
@@ -109,7 +109,10 @@ class Plugin(AbstractPlugin, GeneratorPlugin):
         if result[2]:
             raise RuntimeError(
                 "Subprocess returned message: %s" % result[2])
-        reader = PhantomReader(self.phantom.phout_file)
+        if self.get_option("mmap_reader"):
+            reader = PhantomMmapReader(self.phantom.phout_file)
+        else:
+            reader = PhantomReader(self.phantom.phout_file)
         logger.debug(
             "Linking sample reader to aggregator."
             " Reading samples from %s", self.phantom.phout_file)
@@ -4,12 +4,16 @@ Phantom phout format reader. Read chunks from phout and produce data frames
 import pandas as pd
 import numpy as np
 import logging
-import json
+import mmap
+import re
 import time
 import datetime
-import itertools as itt
 from StringIO import StringIO
 
+from ...common.util import FileFollower
+from ..Aggregator import instrumentation
+from ..Aggregator.tags import UNTAGGED, registry
+
 logger = logging.getLogger(__name__)
 
 phout_columns = [
@@ -42,19 +46,26 @@ def string_to_df(data):
     chunk['receive_ts'] = chunk.send_ts + chunk.interval_real / 1e6
     chunk['receive_sec'] = chunk.receive_ts.astype(np.int64)
     # TODO: consider configuration for the following:
-    chunk['tag'] = chunk.tag.str.rsplit('#', 1, expand=True)[0]
+    chunk['tag'] = registry.encode(chunk.tag, strip_marker=True)
     chunk.set_index(['receive_sec'], inplace=True)
 
-    logger.debug("Chunk decode time: %.2fms", (time.time() - start_time) * 1000)
+    instrumentation.parse.add(time.time() - start_time, len(chunk))
     return chunk
 
 
 class PhantomReader(object):
+    """
+    Reads phout by chunks of complete lines. Chunks are parsed with
+    parser, if parser is None raw strings are passed so that they could
+    be parsed somewhere else (in aggregator worker processes)
+    """
+
     def __init__(self, filename, cache_size=1024 * 1024 * 50):
         self.buffer = ""
-        self.phout = open(filename, 'r')
+        self.phout = FileFollower(filename)
         self.closed = False
         self.cache_size = cache_size
+        self.parser = string_to_df
 
     def _read_phout_chunk(self):
         data = self.phout.read(self.cache_size)
@@ -63,11 +74,11 @@ class PhantomReader(object):
             if len(parts) > 1:
                 ready_chunk = self.buffer + parts[0] + '\n'
                 self.buffer = parts[1]
-                return string_to_df(ready_chunk)
+                if self.parser is None:
+                    return ready_chunk
+                return self.parser(ready_chunk)
             else:
                 self.buffer += parts[0]
-        else:
-            self.buffer += self.phout.readline()
         return None
 
     def __iter__(self):
@@ -76,74 +87,353 @@ class PhantomReader(object):
         yield self._read_phout_chunk()
         self.phout.close()
 
+    def wait(self, timeout):
+        return self.phout.wait(timeout)
+
     def close(self):
         self.closed = True
 
 
+TAB, NEWLINE, CR, HASH, DOT, MINUS, ZERO = (ord(c) for c in '\t\n\r#.-0')
+# so that digits fit into int64
+MAX_DIGITS = 18
+
+
+def _gather(buf, starts, ends, align_right):
+    """
+    Matrix of fields bytes, a row per field, padded with zeros
+    """
+    width = int((ends - starts).max()) if len(starts) else 0
+    if align_right:
+        pos = ends[:, None] - width + np.arange(width)
+        padding = pos < starts[:, None]
+    else:
+        pos = starts[:, None] + np.arange(width)
+        padding = pos >= ends[:, None]
+    chars = buf.take(pos, mode='clip')
+    chars[padding] = 0
+    return chars
+
+
+def _parse_digits(buf, starts, ends, allow_dot):
+    """
+    Parse decimal numbers right from the bytes buffer. Returns
+    (<all digits as a number>, <dot position from the right, -1 if no dot>),
+    raises ValueError if there is something that is not a number
+    """
+    chars = _gather(buf, starts, ends, align_right=True)
+    width = chars.shape[1]
+    if width > MAX_DIGITS:
+        raise ValueError("Number is too long: %s chars" % width)
+    digits = chars - ZERO
+    unexpected = (digits > 9) & (chars != 0)
+    rows = np.arange(len(chars))
+    first = width - (ends - starts)
+    negative = chars[rows, np.minimum(first, width - 1)] == MINUS
+    unexpected[rows[negative], first[negative]] = False
+    dots = np.full(len(chars), -1)
+    if allow_dot:
+        is_dot = chars == DOT
+        unexpected &= ~is_dot
+        has_dot = is_dot.any(axis=1)
+        dots[has_dot] = width - 1 - np.argmax(is_dot[has_dot], axis=1)
+    if unexpected.any():
+        raise ValueError("Not a number")
+    digits[digits > 9] = 0
+    values = digits.dot(10**np.arange(width - 1, -1, -1, dtype=np.int64))
+    values[negative] *= -1
+    return values, dots
+
+
+def _parse_ints(buf, starts, ends):
+    return _parse_digits(buf, starts, ends, allow_dot=False)[0]
+
+
+def _parse_floats(buf, starts, ends):
+    values, dots = _parse_digits(buf, starts, ends, allow_dot=True)
+    # the dot is counted as a zero digit, so split the number by it
+    integral, fractional = np.divmod(values, 10**(dots + 1))
+    return integral + fractional / 10.0**np.maximum(dots, 0)
+
+
+def _parse_tags(buf, starts, ends):
+    """
+    Tags as fixed width bytes, everything after the last '#' is cut off
+    """
+    chars = _gather(buf, starts, ends, align_right=False)
+    if not chars.shape[1]:
+        return np.zeros(len(starts), dtype='S1')
+    is_hash = chars == HASH
+    has_hash = is_hash.any(axis=1)
+    last_hash = chars.shape[1] - 1 - np.argmax(is_hash[:, ::-1], axis=1)
+    cut = np.where(has_hash, last_hash, chars.shape[1])
+    chars[np.arange(chars.shape[1]) >= cut[:, None]] = 0
+    return np.ascontiguousarray(chars).view('S%d' % chars.shape[1]).ravel()
+
+
+def buffer_to_df(buf, tags=registry):
+    """
+    Parse phout lines right from the bytes buffer (numpy uint8 array)
+    into a dataframe, the same as string_to_df does.
+    Raises ValueError if data is not a proper phout
+    """
+    start_time = time.time()
+    seps = np.flatnonzero((buf == TAB) | (buf == NEWLINE))
+    fields_count = len(phout_columns)
+    if len(seps) % fields_count or not np.all(
+            buf[seps[fields_count - 1::fields_count]] == NEWLINE):
+        raise ValueError("Phout lines should have %s fields" % fields_count)
+    ends = seps.reshape(-1, fields_count)
+    starts = np.empty_like(ends)
+    starts[:, 1:] = ends[:, :-1] + 1
+    starts[0, 0] = 0
+    starts[1:, 0] = ends[:-1, -1] + 1
+    # CRLF line endings
+    ends[:, -1] -= buf[np.maximum(ends[:, -1] - 1, 0)] == CR
+
+    columns = {'send_ts': _parse_floats(buf, starts[:, 0], ends[:, 0])}
+    numbers = np.empty((fields_count - 2, len(ends)), dtype=np.int64)
+    for i, column in enumerate(phout_columns[2:]):
+        numbers[i] = _parse_ints(buf, starts[:, i + 2], ends[:, i + 2])
+        columns[column] = numbers[i]
+
+    names, codes = np.unique(
+        _parse_tags(buf, starts[:, 1], ends[:, 1]), return_inverse=True)
+    ids = np.array(
+        [tags.intern(name.decode('utf8')) for name in names.tolist()],
+        dtype=np.int32)
+    columns['tag'] = ids[codes.ravel()]
+    # the same as NaN for an empty tag in string_to_df
+    columns['tag'][starts[:, 1] == ends[:, 1]] = UNTAGGED
+
+    chunk = pd.DataFrame(columns, columns=phout_columns)
+    chunk['receive_ts'] = chunk.send_ts + chunk.interval_real / 1e6
+    chunk['receive_sec'] = chunk.receive_ts.astype(np.int64)
+    chunk.set_index(['receive_sec'], inplace=True)
+
+    instrumentation.parse.add(time.time() - start_time, len(chunk))
+    return chunk
+
+
+def bytes_to_df(data):
+    """
+    buffer_to_df for bytes, falls back to string_to_df if data is not
+    a regular phout
+    """
+    try:
+        return buffer_to_df(np.frombuffer(data, dtype=np.uint8))
+    except ValueError as e:
+        logger.warning(
+            "Unexpected phout format, using csv parser for a chunk: %s", e)
+    return string_to_df(data.decode('utf8'))
+
+
+class PhantomMmapReader(object):
+    """
+    Phout reader that maps the growing file into memory and parses
+    numbers right from the mapped buffer, with no string copies.
+    Falls back to string_to_df if a chunk is not a regular phout.
+    If parser is None, raw bytes chunks are passed like in PhantomReader
+    """
+
+    def __init__(self, filename, cache_size=1024 * 1024 * 8):
+        self.phout = FileFollower(filename, 'rb')
+        self.offset = 0
+        self.closed = False
+        self.cache_size = cache_size
+        self.parser = bytes_to_df
+
+    def _parse_mapped(self, mapped, begin, end):
+        if self.parser is None:
+            return mapped[begin:end]
+        if self.parser is not bytes_to_df:
+            return self.parser(mapped[begin:end])
+        buf = np.frombuffer(
+            mapped, dtype=np.uint8, count=end - begin, offset=begin)
+        try:
+            return buffer_to_df(buf)
+        except ValueError as e:
+            logger.warning(
+                "Unexpected phout format, using csv parser for a chunk: %s", e)
+        finally:
+            # mapping can't be closed while there are arrays pointing to it
+            del buf
+        return string_to_df(mapped[begin:end].decode('utf8'))
+
+    def _read_phout_chunk(self):
+        size = self.phout.size()
+        if size <= self.offset:
+            self.phout.mark(size)
+            return None
+        map_start = self.offset - self.offset % mmap.ALLOCATIONGRANULARITY
+        window = self.cache_size
+        while True:
+            map_end = min(size, self.offset + window)
+            self.phout.mark(size if map_end == size else None)
+            mapped = mmap.mmap(
+                self.phout.fileno(),
+                map_end - map_start,
+                access=mmap.ACCESS_READ,
+                offset=map_start)
+            try:
+                begin = self.offset - map_start
+                end = mapped.rfind(b'\n', begin) + 1
+                if end > begin:
+                    self.offset = map_start + end
+                    return self._parse_mapped(mapped, begin, end)
+            finally:
+                mapped.close()
+            if map_end == size:
+                # the last line is not complete yet
+                return None
+            # a line longer than the window, it is mapped whole
+            window *= 2
+
+    def __iter__(self):
+        while not self.closed:
+            yield self._read_phout_chunk()
+        yield self._read_phout_chunk()
+        self.phout.close()
+
+    def wait(self, timeout):
+        return self.phout.wait(timeout)
+
+    def close(self):
+        self.closed = True
+
+
+# strings are matched whole (group 2 is None when a string is not complete
+# yet), so that braces in strings are skipped
+json_token = re.compile(r'"((?:[^"\\]|\\.)*)(")?|[{}]')
+mmtasks_value = re.compile(
+    r'"mmtasks"\s*:\s*\[\s*[^,\]]*,\s*[^,\]]*,\s*(-?\d+)')
+
+
+class JsonMemberSplitter(object):
+    """
+    Splits a growing stream of '"key": {...}' members into complete
+    members. Members may be enclosed in braces (and enclosed objects may
+    follow each other), separators between them are skipped. Brace depth is
+    kept between calls, so every byte is scanned once
+    """
+
+    def __init__(self):
+        self.buffer = ''
+        self.pos = 0
+        self.depth = 0
+        # depth of members, it is 1 inside of enclosing braces
+        self.base = 0
+        self.key = None
+        self.start = None
+
+    def feed(self, data):
+        """
+        List of (key, value text) of members completed with data
+        """
+        self.buffer += data
+        members = []
+        consumed = 0
+        pos = len(self.buffer)
+        for match in json_token.finditer(self.buffer, self.pos):
+            token = match.group()
+            if token == '{':
+                if self.depth == self.base:
+                    if self.key is None:
+                        self.base += 1
+                    else:
+                        self.start = match.start()
+                self.depth += 1
+            elif token == '}':
+                self.depth -= 1
+                if self.depth == self.base and self.start is not None:
+                    members.append(
+                        (self.key, self.buffer[self.start:match.end()]))
+                    self.key = self.start = None
+                    consumed = match.end()
+                elif self.depth < self.base:
+                    self.base = self.depth
+                    consumed = match.end()
+            elif match.group(2) is None:
+                pos = match.start()
+                break
+            elif self.depth == self.base:
+                self.key = match.group(1)
+        self.buffer = self.buffer[consumed:]
+        self.pos = pos - consumed
+        return members
+
+
 class PhantomStatsReader(object):
-    def __init__(self, filename, phantom_info):
+    """
+    Reads phantom stat log as it grows. Only instances (the third mmtasks
+    value of benchmark_io* stats) are taken out of every second
+    """
+
+    def __init__(self, filename, phantom_info, cache_size=1024 * 1024 * 50):
         self.phantom_info = phantom_info
-        self.buffer = ""
-        self.stat_buffer = ""
+        self.splitter = JsonMemberSplitter()
         self.stat_filename = filename
+        self.stat_file = None
+        self.cache_size = cache_size
         self.closed = False
         self.start_time = 0
+        self.minute = None
+        self.minute_ts = 0
 
-    def _decode_stat_data(self, chunk):
+    def _timestamp(self, date_str):
         """
-        Return all items found in this chunk
+        Local time of '%Y-%m-%d %H:%M:%S.%f', a minute is parsed once
         """
-        for date_str, statistics in chunk.iteritems():
-            date_obj = datetime.datetime.strptime(
-                date_str.split(".")[0], '%Y-%m-%d %H:%M:%S')
-            chunk_date = int(time.mktime(date_obj.timetuple()))
-            instances = 0
-            for benchmark_name, benchmark in statistics.iteritems():
-                if not benchmark_name.startswith("benchmark_io"):
-                    continue
-                for method, meth_obj in benchmark.iteritems():
-                    if "mmtasks" in meth_obj:
-                        instances += meth_obj["mmtasks"][2]
-
-            offset = chunk_date - 1 - self.start_time
-            reqps = 0
-            if offset >= 0 and offset < len(self.phantom_info.steps):
-                reqps = self.phantom_info.steps[offset][0]
-            yield {
-                'ts': chunk_date - 1,
-                'metrics': {
-                    'instances': instances,
-                    'reqps': reqps
-                }
+        minute, seconds = date_str.split('.')[0].rsplit(':', 1)
+        if minute != self.minute:
+            date_obj = datetime.datetime.strptime(minute, '%Y-%m-%d %H:%M')
+            self.minute_ts = int(time.mktime(date_obj.timetuple()))
+            self.minute = minute
+        return self.minute_ts + int(seconds)
+
+    def _decode_stat_data(self, date_str, statistics):
+        chunk_date = self._timestamp(date_str)
+        instances = 0
+        for benchmark_name, benchmark in JsonMemberSplitter().feed(statistics):
+            if benchmark_name.startswith("benchmark_io"):
+                instances += sum(
+                    int(value)
+                    for value in mmtasks_value.findall(benchmark))
+
+        offset = chunk_date - 1 - self.start_time
+        reqps = 0
+        if offset >= 0 and offset < len(self.phantom_info.steps):
+            reqps = self.phantom_info.steps[offset][0]
+        return {
+            'ts': chunk_date - 1,
+            'metrics': {
+                'instances': instances,
+                'reqps': reqps
             }
+        }
 
-    def _read_stat_data(self, stat_file):
-        chunk = stat_file.read(1024 * 1024 * 50)
+    def _read_stat_data(self, stat_file, size=None):
+        chunk = stat_file.read(size or self.cache_size)
         if chunk:
-            self.stat_buffer += chunk
-            parts = self.stat_buffer.rsplit('\n},', 1)
-            if len(parts) > 1:
-                ready_chunk = parts[0]
-                self.stat_buffer = parts[1]
-                chunks = [
-                    json.loads('{%s}}' % s) for s in ready_chunk.split('\n},')
-                ]
-                return list(
-                    itt.chain(
-                        *(self._decode_stat_data(chunk) for chunk in chunks)))
-        else:
-            self.stat_buffer += stat_file.readline()
+            items = [
+                self._decode_stat_data(date_str, statistics)
+                for date_str, statistics in self.splitter.feed(chunk)
+            ]
+            if items:
+                return items
 
     def __iter__(self):
-        """
-        Union buffer and chunk, split using '\n},',
-        return splitted parts
-        """
         self.start_time = int(time.time())
-        with open(self.stat_filename, 'r') as stat_file:
+        self.stat_file = FileFollower(self.stat_filename)
+        try:
             while not self.closed:
-                yield self._read_stat_data(stat_file)
-            yield self._read_stat_data(stat_file)
+                yield self._read_stat_data(self.stat_file)
+            yield self._read_stat_data(self.stat_file, -1)
+        finally:
+            self.stat_file.close()
+
+    def wait(self, timeout):
+        return self.stat_file.wait(timeout)
 
     def close(self):
         self.closed = True
@@ -0,0 +1,169 @@
+"""
+Offline replay of finished phouts: re-aggregate them as fast as the disk
+allows and pass results to aggregate result listeners. Used to regenerate
+reports (test_data.log for tank-postloader, for example) without running
+a test again
+"""
+import argparse
+import itertools as itt
+import json
+import logging
+import sys
+
+import numpy as np
+from pkg_resources import resource_string
+
+from ...common.interfaces import AggregateResultListener
+from ..Aggregator.aggregator import Aggregator, Cumulative, Worker
+from ..Aggregator.chopper import AccumulatingChopper, ParallelChopper
+from ..Aggregator.histogram import get_histogram
+from .phout_bin import MAGIC, PhoutBinReader
+from .reader import PhantomMmapReader, PhantomReader, bytes_to_df, \
+    string_to_df
+
+logger = logging.getLogger(__name__)
+
+
+def is_binary(filename):
+    with open(filename, 'rb') as phout:
+        return phout.read(len(MAGIC)) == MAGIC
+
+
+def read_phout(filename, mmap_reader=False, parse=True):
+    """
+    Chunks of a finished phout, it is not waited to grow
+    """
+    if is_binary(filename):
+        reader = PhoutBinReader(filename)
+    else:
+        reader = (PhantomMmapReader if mmap_reader else PhantomReader)(
+            filename)
+    if not parse:
+        reader.parser = None
+    for chunk in reader:
+        if chunk is None:
+            reader.close()
+        else:
+            yield chunk
+
+
+def replay(
+        filenames,
+        listeners,
+        verbose_histogram=False,
+        workers=0,
+        mmap_reader=False,
+        histogram_backend='verbose',
+        significant_digits=2,
+        cumulative=False):
+    """
+    Aggregate phouts and notify listeners, like Aggregator plugin does.
+    Several phouts (of several generators) are aggregated together. With
+    workers, phouts are parsed and folded in that number of processes,
+    binary phouts are read in one process. There are no stats in phouts,
+    stats are empty.
+
+    All the data is there, so there is no lateness window: seconds are
+    kept folded into accumulators until phouts are read to the end and
+    samples of a second are aggregated together wherever they are in
+    phouts. Memory grows with test duration and number of tags, not with
+    number of samples
+    """
+    if workers and any(is_binary(filename) for filename in filenames):
+        logger.warning("Binary phouts are read in one process")
+        workers = 0
+    config = json.loads(
+        resource_string('yandextank.plugins.Aggregator', 'config/phout.json')
+        .decode('utf8'))
+    quantile_histogram = get_histogram(histogram_backend, significant_digits)
+    worker = Worker(config, verbose_histogram, quantile_histogram)
+    chunks = itt.chain.from_iterable(
+        read_phout(filename, mmap_reader, parse=not workers)
+        for filename in filenames)
+    if workers:
+        chopper = ParallelChopper(
+            chunks, worker, bytes_to_df if mmap_reader else string_to_df,
+            workers, 3, max_lateness=float('inf'))
+    else:
+        chopper = AccumulatingChopper(
+            chunks, worker, 3, max_lateness=float('inf'))
+    pipeline = Aggregator(
+        chopper, config, verbose_histogram,
+        quantile_histogram=quantile_histogram, keep_partials=cumulative)
+    whole_test = Cumulative(pipeline.worker) if cumulative else None
+    for data in pipeline:
+        if whole_test and data.accumulator:
+            whole_test.add(data['ts'], data.accumulator)
+        stats = {'ts': data['ts'], 'metrics': {'instances': 0, 'reqps': 0}}
+        for listener in listeners:
+            listener.on_aggregated_data(data, stats)
+    if whole_test and whole_test.get():
+        for listener in listeners:
+            listener.on_cumulative_data(whole_test.get(), True)
+
+
+def _to_builtin(obj):
+    """
+    json default for numpy scalars, that are not ints and floats in python 3
+    """
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError("%r is not JSON serializable" % obj)
+
+
+class JsonLogListener(AggregateResultListener):
+    """
+    Writes results in JsonReport format
+    """
+
+    def __init__(self, data_log, cumulative_log=None):
+        self.data_log = data_log
+        self.cumulative_log = cumulative_log
+
+    def on_aggregated_data(self, data, stats):
+        self.data_log.write(
+            '%s\n' % json.dumps({
+                'data': data,
+                'stats': stats
+            }, default=_to_builtin))
+
+    def on_cumulative_data(self, data, final):
+        if self.cumulative_log:
+            with open(self.cumulative_log, 'w') as cumulative_log:
+                json.dump(data, cumulative_log, default=_to_builtin)
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    parser = argparse.ArgumentParser(
+        description='Re-aggregate finished phouts into JsonReport test data '
+        'log (it can be uploaded with tank-postloader then).')
+    parser.add_argument('phout', nargs='+', help='phout files of a test')
+    parser.add_argument(
+        '-o', '--output', default='test_data.log',
+        help='test data log, - for stdout')
+    parser.add_argument(
+        '-w', '--workers', default=0, type=int,
+        help='parse and aggregate in this number of processes')
+    parser.add_argument(
+        '-c', '--cumulative', help='save whole-test aggregates to this file')
+    parser.add_argument(
+        '--verbose-histogram', action='store_true',
+        help='aggregate with verbose histogram')
+    parser.add_argument(
+        '--mmap', action='store_true', help='use mmap phout reader')
+    args = parser.parse_args()
+
+    output = sys.stdout if args.output == '-' else open(args.output, 'w')
+    try:
+        replay(
+            args.phout, [JsonLogListener(output, args.cumulative)],
+            verbose_histogram=args.verbose_histogram,
+            workers=args.workers,
+            mmap_reader=args.mmap,
+            cumulative=bool(args.cumulative))
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    logger.info("Test data saved to %s", args.output)
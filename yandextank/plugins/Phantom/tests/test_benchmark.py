@@ -0,0 +1,70 @@
+import json
+
+import numpy as np
+
+from yandextank.plugins.Aggregator.tags import registry
+from yandextank.plugins.Phantom.benchmark import compare, generate_phout, \
+    host_info, load_baseline, maxrss_growth, run_benchmarks, split_chunks
+from yandextank.plugins.Phantom.reader import string_to_df
+
+
+class TestGeneratePhout(object):
+    def test_phout(self):
+        df = string_to_df(generate_phout(
+            10000, rps=1000, tags=3, net_errors=0.1, http_errors=0.2))
+        assert len(df) == 10000
+        assert len(df.index.unique()) in (10, 11)
+        assert sorted(registry.name(tag) for tag in df.tag.unique()) == \
+            ['tag0', 'tag1', 'tag2']
+        assert abs((df.net_code != 0).mean() - 0.1) < 0.02
+        assert abs((df.proto_code >= 400).mean() - 0.2) < 0.02
+        assert (df.proto_code[df.net_code != 0] == 0).all()
+        assert (df.interval_real > 0).all()
+
+    def test_split_chunks(self):
+        data = generate_phout(1000)
+        chunks = split_chunks(data, 300)
+        assert [chunk.count('\n') for chunk in chunks] == [300, 300, 300, 100]
+        assert ''.join(chunks) == data
+
+
+class TestBenchmarks(object):
+    def test_run(self):
+        results = run_benchmarks(
+            generate_phout(2000), chunk_rows=500, repeat=1,
+            names=['string_to_df', 'pipeline'])
+        assert sorted(results) == ['pipeline', 'string_to_df']
+        assert all(
+            np.isfinite(result['rows_per_sec']) for result in results.values())
+
+    def test_compare(self):
+        baseline = {
+            'fast': {'rows_per_sec': 1000, 'peak_memory': 100},
+            'slow': {'rows_per_sec': 1000, 'peak_memory': None},
+        }
+        results = {
+            'fast': {'rows_per_sec': 900, 'peak_memory': 150},
+            'slow': {'rows_per_sec': 700, 'peak_memory': 100},
+            'new': {'rows_per_sec': 1, 'peak_memory': 1},
+        }
+        regressions = compare(results, baseline, tolerance=0.2)
+        assert len(regressions) == 2
+        assert regressions[0].startswith('fast: 150 bytes')
+        assert regressions[1].startswith('slow: 700 rows/s')
+
+    def test_maxrss_growth(self):
+        # python 2 has no tracemalloc
+        growth = maxrss_growth(lambda: np.ones(64 * 1024 * 1024 // 8).sum())
+        assert 48 * 1024 * 1024 < growth < 128 * 1024 * 1024
+
+    def test_load_baseline(self, tmpdir):
+        baseline = tmpdir.join('baseline.json')
+        params = {'rows': 10}
+        results = {'pipeline': {'rows_per_sec': 1000, 'peak_memory': 100}}
+        baseline.write(json.dumps({
+            'params': params, 'host': host_info(), 'results': results}))
+        assert load_baseline(str(baseline), params, host_info()) == results
+        other_host = dict(host_info(), cpu_count=-1)
+        assert load_baseline(str(baseline), params, other_host) == {}
+        assert load_baseline(
+            str(tmpdir.join('missing.json')), params, host_info()) == {}
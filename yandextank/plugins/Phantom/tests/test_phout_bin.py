@@ -0,0 +1,103 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from yandextank.plugins.Aggregator.tags import UNTAGGED, registry
+from yandextank.plugins.Phantom.phout_bin import PhoutBinReader, \
+    PhoutBinWriter, convert, header, phout_columns
+from yandextank.plugins.Phantom.reader import PhantomReader
+from yandextank.plugins.Phantom.replay import replay
+
+PHOUT = 'yandextank/plugins/Phantom/tests/phout.dat'
+
+
+def read_all(reader):
+    chunks = []
+    for chunk in reader:
+        if chunk is None:
+            reader.close()
+        else:
+            chunks.append(chunk)
+    return pd.concat(chunks)
+
+
+class TestPhoutBin(object):
+    def test_convert(self, tmpdir):
+        phout_bin = str(tmpdir.join('phout.bin'))
+        assert convert(PHOUT, phout_bin, chunk_size=70) == 200
+        df = read_all(PhoutBinReader(phout_bin, cache_size=1000))
+        expected = read_all(PhantomReader(PHOUT))
+        pd.testing.assert_frame_equal(df, expected)
+
+    def test_growing_file(self, tmpdir):
+        phout_bin = str(tmpdir.join('phout.bin'))
+        writer = PhoutBinWriter(phout_bin)
+        reader = PhoutBinReader(phout_bin)
+        chunks = iter(reader)
+        assert next(chunks) is None
+        writer.write({
+            'send_ts': [1482159960.5, 1482159961.0, 1482159961.5],
+            'tag': ['tag1#0', None, registry.intern('tag2')],
+            'interval_real': [1000, 2000, 3000],
+            'connect_time': [10, 20, 30],
+            'send_time': [1, 2, 3],
+            'latency': [900, 1900, 2900],
+            'receive_time': [89, 78, 67],
+            'interval_event': [990, 1980, 2970],
+            'size_out': [100, 100, 100],
+            'size_in': [1000, 0, 1000],
+            'net_code': [0, 110, 0],
+            'proto_code': [200, 0, 404],
+        })
+        # a half written block is not read
+        with open(phout_bin, 'rb') as phout:
+            data = phout.read()
+        partial = str(tmpdir.join('partial.bin'))
+        with open(partial, 'wb') as phout:
+            phout.write(data[:len(data) - 10])
+        assert next(iter(PhoutBinReader(partial))) is None
+        chunk = next(chunks)
+        assert chunk.tag.tolist() == [
+            registry.intern('tag1'), UNTAGGED, registry.intern('tag2')]
+        assert chunk.index.tolist() == [1482159960, 1482159961, 1482159961]
+        assert chunk.net_code.tolist() == [0, 110, 0]
+        assert chunk.interval_real.dtype == np.int64
+        writer.close()
+
+    @pytest.mark.parametrize('column, value', [
+        ('interval_real', 2 ** 31),
+        ('connect_time', -2 ** 31 - 1),
+        ('proto_code', 40000),
+        ('size_in', -1),
+        ('latency', float('nan')),
+    ])
+    def test_out_of_range(self, tmpdir, column, value):
+        data = {column: [0] for column in phout_columns}
+        data['send_ts'] = [1482159960.5]
+        data[column] = [value]
+        writer = PhoutBinWriter(str(tmpdir.join('phout.bin')))
+        with pytest.raises(ValueError, match=column):
+            writer.write(data)
+        writer.close()
+
+    def test_bad_header(self, tmpdir):
+        phout = tmpdir.join('phout.log')
+        phout.write('x' * header.size)
+        with pytest.raises(ValueError, match='not a binary phout'):
+            next(iter(PhoutBinReader(str(phout))))
+
+    def test_replay(self, tmpdir):
+        phout_bin = str(tmpdir.join('phout.bin'))
+        convert(PHOUT, phout_bin)
+
+        class Collector(object):
+            def __init__(self):
+                self.data = []
+
+            def on_aggregated_data(self, data, stats):
+                self.data.append(data)
+
+        text, binary = Collector(), Collector()
+        replay([PHOUT], [text])
+        replay([phout_bin], [binary], workers=2)
+        assert binary.data == text.data
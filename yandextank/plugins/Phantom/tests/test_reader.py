@@ -1,6 +1,12 @@
+import json
+import time
+
 import pandas as pd
+import pytest
 
-from yandextank.plugins.Phantom.reader import PhantomReader
+from yandextank.plugins.Aggregator.tags import registry
+from yandextank.plugins.Phantom.reader import PhantomReader, PhantomMmapReader, \
+    PhantomStatsReader
 
 
 class TestPhantomReader(object):
@@ -15,3 +21,91 @@ class TestPhantomReader(object):
                 df = df.append(chunk)
         assert (len(df) == 200)
         assert (df['interval_real'].mean() == 11000714.0)
+
+
+class TestPhantomMmapReader(object):
+    def test_read_all(self):
+        reader = PhantomMmapReader(
+            'yandextank/plugins/Phantom/tests/phout.dat', cache_size=1024)
+        df = pd.DataFrame()
+        for chunk in reader:
+            if chunk is None:
+                reader.close()
+            else:
+                df = df.append(chunk)
+        assert (len(df) == 200)
+        assert (df['interval_real'].mean() == 11000714.0)
+        assert (df['send_ts'].iloc[0] == 1482159938.776)
+        assert (set(df['tag'].map(registry.name)) == {''})
+
+    def test_long_lines(self):
+        # lines are longer than cache_size
+        reader = PhantomMmapReader(
+            'yandextank/plugins/Phantom/tests/phout.dat', cache_size=16)
+        df = pd.DataFrame()
+        for chunk in reader:
+            if chunk is None:
+                reader.close()
+            else:
+                df = df.append(chunk)
+        assert (len(df) == 200)
+
+
+class PhantomInfo(object):
+    steps = [(10, 1), (20, 1)]
+
+
+def stat_second(date_str, tasks):
+    return '"%s" : %s' % (date_str, json.dumps({
+        "benchmark_io": {
+            "stream_method": {"mmtasks": [1, 2, tasks], "note": "{}"},
+            "other_method": {"answ_time": [1, 2]},
+        },
+        "benchmark_io1": {"method": {"mmtasks": [0, 0, 1]}},
+        "monitor": {"mmtasks": [0, 0, 100]},
+    }, indent=1))
+
+
+class TestPhantomStatsReader(object):
+    @pytest.mark.parametrize('enclosed', [False, True])
+    def test_read_all(self, tmpdir, enclosed):
+        seconds = [
+            stat_second('2016-12-19 18:45:59.000', 5),
+            stat_second('2016-12-19 18:46:00.000', 7),
+            stat_second('2016-12-19 18:46:01.000', 9),
+        ]
+        if enclosed:
+            data = ',\n'.join('{%s}' % second for second in seconds)
+        else:
+            data = ''.join('%s\n},\n' % second[:-1] for second in seconds)
+        stat_log = tmpdir.join('phantom_stat.log')
+        stat_log.write(data)
+        reader = PhantomStatsReader(str(stat_log), PhantomInfo(), 100)
+        items = []
+        for chunk in reader:
+            if chunk is None:
+                reader.close()
+            else:
+                items.extend(chunk)
+        start = int(time.mktime((2016, 12, 19, 18, 45, 59, 0, 0, -1)))
+        assert [item['ts'] for item in items] == [
+            start - 1, start, start + 1]
+        assert [item['metrics']['instances'] for item in items] == [6, 8, 10]
+
+    def test_growing_file(self, tmpdir):
+        stat_log = tmpdir.join('phantom_stat.log')
+        stat_log.write('')
+        reader = PhantomStatsReader(str(stat_log), PhantomInfo())
+        chunks = iter(reader)
+        assert next(chunks) is None
+        assert not reader.wait(0.1)
+        # stats are written after the reader has hit the end of file
+        stat_log.write(''.join('%s\n},\n' % second[:-1] for second in [
+            stat_second('2016-12-19 18:45:59.000', 5),
+            stat_second('2016-12-19 18:46:00.000', 7),
+        ]), mode='a')
+        assert reader.wait(1)
+        items = next(chunks)
+        assert [item['metrics']['instances'] for item in items] == [6, 8]
+        reader.close()
+        assert list(chunks) == [None]
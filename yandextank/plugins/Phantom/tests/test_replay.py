@@ -0,0 +1,66 @@
+import json
+from StringIO import StringIO
+
+import pytest
+
+from yandextank.common.interfaces import AggregateResultListener
+from yandextank.plugins.Phantom.replay import JsonLogListener, replay
+
+PHOUT = 'yandextank/plugins/Phantom/tests/phout.dat'
+
+
+class Collector(AggregateResultListener):
+    def __init__(self):
+        self.data = []
+        self.cumulative = None
+
+    def on_aggregated_data(self, data, stats):
+        self.data.append(data)
+
+    def on_cumulative_data(self, data, final):
+        self.cumulative = data
+
+
+class TestReplay(object):
+    def test_replay(self):
+        collector = Collector()
+        replay([PHOUT], [collector], cumulative=True)
+        assert sum(d['overall']['interval_real']['len']
+                   for d in collector.data) == 200
+        assert sorted(d['ts'] for d in collector.data) == \
+            [d['ts'] for d in collector.data]
+        assert collector.cumulative['overall']['interval_real']['len'] == 200
+
+    def test_replay_several_phouts(self):
+        collector = Collector()
+        replay([PHOUT, PHOUT], [collector])
+        assert sum(d['overall']['interval_real']['len']
+                   for d in collector.data) == 400
+        assert len(set(d['ts'] for d in collector.data)) == len(collector.data)
+        assert sorted(d['ts'] for d in collector.data) == \
+            [d['ts'] for d in collector.data]
+
+    @pytest.mark.parametrize('workers', [0, 2])
+    def test_out_of_order(self, tmpdir, workers):
+        with open(PHOUT) as phout:
+            lines = phout.readlines()
+        # seconds of the beginning are written after the end
+        shuffled = tmpdir.join('shuffled.log')
+        shuffled.write(''.join(lines[60:] + lines[:60]))
+        collector = Collector()
+        replay([str(shuffled), PHOUT], [collector], workers=workers)
+        expected = Collector()
+        replay([PHOUT, PHOUT], [expected])
+        assert [(d['ts'], d['overall']['interval_real']['len'])
+                for d in collector.data] == [
+            (d['ts'], d['overall']['interval_real']['len'])
+            for d in expected.data]
+
+    def test_json_log(self):
+        data_log = StringIO()
+        replay([PHOUT], [JsonLogListener(data_log)])
+        lines = [json.loads(line) for line in data_log.getvalue().splitlines()]
+        assert lines
+        assert all(set(line) == {'data', 'stats'} for line in lines)
+        assert sum(line['data']['overall']['interval_real']['len']
+                   for line in lines) == 200
@@ -1,4 +1,4 @@
 #
 from .main import Stepper, StepperWrapper  # noqa:F401
 from .info import StepperInfo  # noqa:F401
-from .format import StpdReader  # noqa:F401
+from .format import StpdReader, StpdBinReader, stpd_reader  # noqa:F401
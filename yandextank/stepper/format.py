@@ -1,9 +1,38 @@
 '''
 Ammo formatters
 '''
+import hashlib
 import logging
+import mmap
+import shutil
+import struct
+import tempfile
+from collections import namedtuple
+
+import numpy as np
 
 from .module_exceptions import StpdFileError
+from .util import Interner
+
+# binary stpd: header, records, missiles, markers, index
+STPD_MAGIC = b'STPDBIN\x00'
+STPD_VERSION = 1
+# magic, version, record size, reserved, records, missiles, markers,
+# seconds in index, missiles offset, markers offset, index offset
+stpd_header = struct.Struct('<8sHHIQQQQQQQ')
+stpd_record = np.dtype([
+    ('timestamp', '<i8'),
+    ('missile', '<u4'),
+    ('marker', '<u4'),
+])
+StpdHeader = namedtuple('StpdHeader', [
+    'magic', 'version', 'record_size', 'reserved', 'records', 'missiles',
+    'markers', 'seconds', 'missiles_offset', 'markers_offset', 'index_offset'
+])
+# records are read and written by chunks of this size
+CHUNK_SIZE = 100000
+# total size of missiles that StpdWriter looks up with no hashing
+KNOWN_MISSILES_SIZE = 64 * 1024 * 1024
 
 
 class Stpd(object):
@@ -21,10 +50,14 @@ class Stpd(object):
 
 
 class StpdReader(object):
-    '''Read missiles from stpd file'''
+    '''
+    Read missiles from stpd file. Equal missiles are the same object, so
+    that they are kept once when missiles are cached (cached_stpd in BFG)
+    '''
 
     def __init__(self, filename):
         self.filename = filename
+        self.intern = Interner()
         self.log = logging.getLogger(__name__)
         self.log.info("Loading stepped missiles from '%s'" % filename)
 
@@ -51,10 +84,242 @@ class StpdReader(object):
                         raise StpdFileError(
                             "Unexpected end of file: read %s bytes instead of %s"
                             % (len(missile), chunk_size))
-                    yield (timestamp, missile, marker)
+                    yield (timestamp, self.intern(missile), marker)
                 except (IndexError, ValueError) as e:
                     raise StpdFileError(
                         "Error while reading ammo file. Position: %s, header: '%s', original exception: %s"
                         % (ammo_file.tell(), chunk_header, e))
                 chunk_header = read_chunk_header(ammo_file)
         self.log.info("Reached the end of stpd file")
+
+
+def _align(output):
+    """
+    Pad output so that next array starts at 8 bytes boundary
+    """
+    output.write(b'\0' * (-output.tell() % 8))
+
+
+class StpdWriter(object):
+    '''
+    Writes binary stpd to a seekable binary file: a record of timestamp,
+    missile id and marker id per missile and tables of distinct missiles
+    and markers. Index has a number of the first record of every second,
+    it is written if timestamps are not decreasing
+    '''
+
+    def __init__(self, output):
+        self.log = logging.getLogger(__name__)
+        self.output = output
+        self.output.write(b'\0' * stpd_header.size)
+        self.missile_ids = {}
+        self.known_missiles = {}
+        self.known_size = 0
+        self.missile_offsets = [0]
+        # missile bodies are kept on disk until the end
+        self.missiles = tempfile.TemporaryFile()
+        self.marker_ids = {}
+        self.markers = []
+        self.timestamps = []
+        self.missile_refs = []
+        self.marker_refs = []
+        self.records = 0
+        self.index = []
+        self.seconds = 0
+        self.last_timestamp = 0
+        self.sorted = True
+
+    def _missile_id(self, missile):
+        missile_id = self.known_missiles.get(missile)
+        if missile_id is not None:
+            return missile_id
+        body = missile if isinstance(missile, bytes) \
+            else missile.encode('utf8')
+        # missiles are told apart by digests, so that distinct missiles are
+        # not kept in memory, only first ones are looked up as they are
+        digest = hashlib.md5(body).digest()
+        missile_id = self.missile_ids.get(digest)
+        if missile_id is None:
+            missile_id = self.missile_ids[digest] = len(self.missile_ids)
+            self.missiles.write(body)
+            self.missile_offsets.append(
+                self.missile_offsets[-1] + len(body))
+            if self.known_size < KNOWN_MISSILES_SIZE:
+                self.known_missiles[missile] = missile_id
+                self.known_size += len(body)
+        return missile_id
+
+    def _marker_id(self, marker):
+        marker = str(marker)
+        marker_id = self.marker_ids.get(marker)
+        if marker_id is None:
+            marker_id = self.marker_ids[marker] = len(self.markers)
+            self.markers.append(marker.encode('utf8'))
+        return marker_id
+
+    def write(self, timestamp, marker, missile):
+        self.timestamps.append(timestamp)
+        self.missile_refs.append(self._missile_id(missile))
+        self.marker_refs.append(self._marker_id(marker))
+        if len(self.timestamps) == CHUNK_SIZE:
+            self._flush()
+
+    def _flush(self):
+        chunk = np.empty(len(self.timestamps), dtype=stpd_record)
+        chunk['timestamp'] = self.timestamps
+        chunk['missile'] = self.missile_refs
+        chunk['marker'] = self.marker_refs
+        self.timestamps, self.missile_refs, self.marker_refs = [], [], []
+        timestamps = chunk['timestamp']
+        decreasing = timestamps[0] < self.last_timestamp
+        if self.sorted and (decreasing or np.any(np.diff(timestamps) < 0)):
+            self.log.warning("Timestamps decrease, stpd index is not written")
+            self.sorted = False
+        if self.sorted:
+            seconds = np.arange(
+                self.seconds, timestamps[-1] // 1000 + 1, dtype=np.int64)
+            self.index.append(
+                self.records + np.searchsorted(timestamps, seconds * 1000))
+            self.seconds += len(seconds)
+            self.last_timestamp = timestamps[-1]
+        self.output.write(chunk.tobytes())
+        self.records += len(chunk)
+
+    def _write_table(self, offsets, body):
+        _align(self.output)
+        self.output.write(np.array(offsets, dtype='<u8').tobytes())
+        body.seek(0)
+        shutil.copyfileobj(body, self.output)
+
+    def close(self):
+        if self.timestamps:
+            self._flush()
+        missiles_offset = self.output.tell()
+        self._write_table(self.missile_offsets, self.missiles)
+        self.missiles.close()
+        _align(self.output)
+        markers_offset = self.output.tell()
+        self.output.write(np.cumsum(
+            [0] + [len(marker) for marker in self.markers],
+            dtype='<u8').tobytes())
+        self.output.write(b''.join(self.markers))
+        _align(self.output)
+        index_offset = self.output.tell()
+        index = np.concatenate(self.index) if self.sorted and self.index \
+            else np.array([], dtype=np.int64)
+        self.output.write(index.astype('<u8').tobytes())
+        self.output.seek(0)
+        self.output.write(stpd_header.pack(
+            STPD_MAGIC, STPD_VERSION, stpd_record.itemsize, 0, self.records,
+            len(self.missile_ids), len(self.markers), len(index),
+            missiles_offset, markers_offset, index_offset))
+        self.output.seek(0, 2)
+
+
+class StpdBinReader(object):
+    '''
+    Read missiles from binary stpd. File is mapped into memory, records
+    are read right from the mapping and every distinct missile is copied
+    out of it once. Reading starts from the record set by seek
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.start = 0
+        self.log = logging.getLogger(__name__)
+        self.log.info("Loading binary stepped missiles from '%s'" % filename)
+
+    def _map(self):
+        with open(self.filename, 'rb') as stpd_file:
+            mapped = mmap.mmap(stpd_file.fileno(), 0, access=mmap.ACCESS_READ)
+        header = StpdHeader(*stpd_header.unpack_from(mapped))
+        if header.magic != STPD_MAGIC:
+            mapped.close()
+            raise StpdFileError("%s is not a binary stpd" % self.filename)
+        if header.version != STPD_VERSION or \
+                header.record_size != stpd_record.itemsize:
+            mapped.close()
+            raise StpdFileError(
+                "Unsupported binary stpd version %s" % header.version)
+        return mapped, header
+
+    # arrays pointing to the mapping must not outlive helpers, the mapping
+    # can't be closed while they exist
+
+    @staticmethod
+    def _table(mapped, offset, count):
+        offsets = np.frombuffer(
+            mapped, dtype='<u8', count=count + 1, offset=offset).tolist()
+        body = offset + (count + 1) * 8
+        return [
+            mapped[body + begin:body + end]
+            for begin, end in zip(offsets[:-1], offsets[1:])
+        ]
+
+    @staticmethod
+    def _records(mapped, start, count):
+        records = np.frombuffer(
+            mapped, dtype=stpd_record, count=count,
+            offset=stpd_header.size + start * stpd_record.itemsize)
+        return records['timestamp'], records['missile'], records['marker']
+
+    def _find(self, mapped, header, timestamp):
+        if not header.seconds:
+            raise StpdFileError("There is no index in %s" % self.filename)
+        second = max(timestamp // 1000, 0)
+        if second >= header.seconds:
+            return header.records
+        index = np.frombuffer(
+            mapped, dtype='<u8', count=header.seconds,
+            offset=header.index_offset)
+        begin = int(index[second])
+        end = int(index[second + 1]) if second + 1 < header.seconds \
+            else header.records
+        timestamps = self._records(mapped, begin, end - begin)[0]
+        return begin + int(np.searchsorted(timestamps, timestamp))
+
+    def seek(self, timestamp):
+        '''
+        Start reading from the first missile with timestamp not less than
+        given one, returns its number
+        '''
+        mapped, header = self._map()
+        try:
+            self.start = self._find(mapped, header, timestamp)
+        finally:
+            mapped.close()
+        return self.start
+
+    def _chunks(self, mapped, header):
+        for start in range(self.start, header.records, CHUNK_SIZE):
+            yield [
+                column.tolist() for column in self._records(
+                    mapped, start, min(CHUNK_SIZE, header.records - start))
+            ]
+
+    def __iter__(self):
+        mapped, header = self._map()
+        try:
+            missiles = self._table(
+                mapped, header.missiles_offset, header.missiles)
+            markers = [
+                marker.decode('utf8') for marker in self._table(
+                    mapped, header.markers_offset, header.markers)
+            ]
+            for timestamps, missile_ids, marker_ids in self._chunks(
+                    mapped, header):
+                for timestamp, missile_id, marker_id in zip(
+                        timestamps, missile_ids, marker_ids):
+                    yield (timestamp, missiles[missile_id], markers[marker_id])
+        finally:
+            mapped.close()
+        self.log.info("Reached the end of stpd file")
+
+
+def stpd_reader(filename):
+    '''
+    Reader for text or binary stpd file
+    '''
+    with open(filename, 'rb') as stpd_file:
+        binary = stpd_file.read(len(STPD_MAGIC)) == STPD_MAGIC
+    return StpdBinReader(filename) if binary else StpdReader(filename)
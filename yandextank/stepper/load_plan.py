@@ -4,9 +4,24 @@ Load Plan generators
 import re
 from itertools import chain, groupby
 from builtins import range
+
+import numpy as np
+
 from . import info
 from .util import parse_duration, solve_quadratic, proper_round
 
+# timestamps are generated by numpy arrays of this size at most
+CHUNK_SIZE = 100000
+
+
+def _chunked(timestamps, count, chunk_size):
+    """
+    Arrays of timestamps of charges from 0 to count by chunk_size
+    """
+    for start in range(0, count, chunk_size):
+        yield timestamps(
+            np.arange(start, min(start + chunk_size, count), dtype=np.int64))
+
 
 class Const(object):
     '''
@@ -18,12 +33,18 @@ class Const(object):
         self.duration = duration
 
     def __iter__(self):
+        return chain.from_iterable(chunk.tolist() for chunk in self.chunks())
+
+    def chunks(self, chunk_size=CHUNK_SIZE):
+        """
+        Timestamps as numpy arrays of chunk_size at most
+        """
         if self.rps == 0:
             return iter([])
         interval = 1000.0 / self.rps
-        return (
-            int(i * interval)
-            for i in range(0, int(self.rps * self.duration / 1000)))
+        return _chunked(
+            lambda n: (n * interval).astype(np.int64),
+            int(self.rps * self.duration / 1000), chunk_size)
 
     def rps_at(self, t):
         '''Return rps for second t'''
@@ -73,12 +94,31 @@ class Line(object):
             root2 = float(n) / self.minrps
         return int(root2 * 1000)
 
+    def ts_array(self, n):
+        """
+        ts for a numpy array of charge numbers, the same roots are
+        calculated the same way
+        """
+        if self.slope == 0:
+            root2 = n / self.minrps
+        else:
+            a = self.slope / 2.0
+            root2 = (-self.minrps + np.sqrt(
+                (self.minrps * self.minrps) - 4 * a * -n)) / (2 * a)
+        return (root2 * 1000).astype(np.int64)
+
     def __iter__(self):
         """
 
         :return: timestamps for each charge
         """
-        return (self.ts(n) for n in range(0, self.__len__()))
+        return chain.from_iterable(chunk.tolist() for chunk in self.chunks())
+
+    def chunks(self, chunk_size=CHUNK_SIZE):
+        """
+        Timestamps as numpy arrays of chunk_size at most
+        """
+        return _chunked(self.ts_array, self.__len__(), chunk_size)
 
     def rps_at(self, t):
         '''Return rps for second t'''
@@ -126,10 +166,17 @@ class Composite(object):
         self.steps = steps
 
     def __iter__(self):
+        return chain.from_iterable(chunk.tolist() for chunk in self.chunks())
+
+    def chunks(self, chunk_size=CHUNK_SIZE):
+        """
+        Timestamps as numpy arrays of chunk_size at most, steps are shifted
+        by durations of previous ones
+        """
         base = 0
         for step in self.steps:
-            for ts in step:
-                yield ts + base
+            for chunk in step.chunks(chunk_size):
+                yield chunk + base
             base += step.get_duration()
 
     def get_duration(self):
@@ -13,6 +13,8 @@ from ..common.resource import manager as resource
 from . import format as fmt
 from . import info
 from .config import ComponentFactory
+from .shards import ShardedStpd
+from .util import Interner
 
 
 class AmmoFactory(object):
@@ -30,6 +32,7 @@ class AmmoFactory(object):
         self.ammo_generator = factory.get_ammo_generator()
         self.filter = factory.get_filter()
         self.marker = factory.get_marker()
+        self.intern = Interner()
 
     def __iter__(self):
         '''
@@ -37,11 +40,13 @@ class AmmoFactory(object):
         where missile is in a string representation. Load Plan (timestamps
         generator) and ammo generator are taken from the previously
         configured ComponentFactory, passed as a parameter to the
-        __init__ method of this class.
+        __init__ method of this class. Equal missiles are the same object
+        (ammo files are read again on every loop), so that formatters and
+        BFG keep them once.
         '''
         ammo_stream = (
             ammo
-            for ammo in ((missile, marker or self.marker(missile))
+            for ammo in ((self.intern(missile), marker or self.marker(missile))
                          for missile, marker in self.ammo_generator)
             if self.filter(ammo))
 
@@ -51,13 +56,38 @@ class AmmoFactory(object):
 
 
 class Stepper(object):
-    def __init__(self, core, **kwargs):
+    def __init__(self, core, binary=False, workers=0, **kwargs):
+        self.log = logging.getLogger(__name__)
         info.status = info.StepperStatus()
         info.status.core = core
         self.af = AmmoFactory(ComponentFactory(**kwargs))
         self.ammo = fmt.Stpd(self.af)
+        self.binary = binary
+        self.workers = workers
+        # charges are formatted out of order in worker processes, so limits
+        # and markers that depend on what was stepped before are not allowed
+        self.shardable = all([
+            kwargs.get('autocases') != 'uniq',
+            not kwargs.get('enum_ammo'),
+            info.status.loop_limit is None,
+            info.status.ammo_limit is None,
+            hasattr(self.af.load_plan, 'chunks'),
+        ])
 
     def write(self, f):
+        if self.binary:
+            if self.workers > 1:
+                self.log.info(
+                    "Binary stpd is stepped in one process, "
+                    "stepper_workers is ignored")
+            return self.write_binary(f)
+        if self.workers > 1:
+            if not self.shardable:
+                self.log.info(
+                    "Ammo limits, enum_ammo and uniq autocases need charges "
+                    "stepped in order, stepping in one process")
+            elif ShardedStpd(self.af, self.workers).write(f):
+                return
         for missile in self.ammo:
             f.write(missile)
             try:
@@ -65,6 +95,19 @@ class Stepper(object):
             except StopIteration:
                 break
 
+    def write_binary(self, f):
+        '''
+        Write binary stpd, f is a seekable binary file
+        '''
+        writer = fmt.StpdWriter(f)
+        for timestamp, marker, missile in self.af:
+            writer.write(timestamp, marker, missile)
+            try:
+                info.status.inc_ammo_count()
+            except StopIteration:
+                break
+        writer.close()
+
 
 class LoadProfile(object):
 
@@ -119,6 +162,8 @@ class StepperWrapper(object):
         self.autocases = 0
         self.enum_ammo = False
         self.use_caching = True
+        self.binary_stpd = False
+        self.stepper_workers = 0
         self.force_stepping = None
         self.chosen_cases = []
 
@@ -151,7 +196,7 @@ class StepperWrapper(object):
         ]
         opts += [
             "use_caching", "cache_dir", "force_stepping", "file_cache",
-            "chosen_cases"
+            "chosen_cases", "stepper_workers"
         ]
         return opts
 
@@ -183,6 +228,7 @@ class StepperWrapper(object):
         cache_dir = self.get_option("cache_dir") or self.core.artifacts_base_dir
         self.cache_dir = os.path.expanduser(cache_dir)
         self.force_stepping = self.get_option("force_stepping")
+        self.stepper_workers = self.get_option("stepper_workers")
         self.chosen_cases = self.get_option("chosen_cases").split()
         if self.chosen_cases:
             self.log.info("chosen_cases LIMITS: %s", self.chosen_cases)
@@ -270,12 +316,15 @@ class StepperWrapper(object):
                 os.makedirs(self.cache_dir)
             stpd = self.cache_dir + '/' + \
                 os.path.basename(self.ammo_file) + \
-                "_" + hasher.hexdigest() + ".stpd"
+                "_" + hasher.hexdigest() + self.__stpd_extension()
         else:
-            stpd = os.path.realpath("ammo.stpd")
+            stpd = os.path.realpath("ammo" + self.__stpd_extension())
         self.log.debug("Generated cache file name: %s", stpd)
         return stpd
 
+    def __stpd_extension(self):
+        return ".stpdb" if self.binary_stpd else ".stpd"
+
     def __read_cached_options(self):
         '''
         Read stepper info from json
@@ -310,6 +359,10 @@ class StepperWrapper(object):
             autocases=self.autocases,
             enum_ammo=self.enum_ammo,
             ammo_type=self.ammo_type,
-            chosen_cases=self.chosen_cases, )
-        with open(self.stpd, 'w', self.file_cache) as os:
+            chosen_cases=self.chosen_cases,
+            binary=self.binary_stpd,
+            workers=self.stepper_workers, )
+        with open(
+                self.stpd, 'wb' if self.binary_stpd else 'w',
+                self.file_cache) as os:
             stepper.write(os)
@@ -85,7 +85,7 @@ class UriStyleGenerator(object):
     def __iter__(self):
         for m in self.missiles:
             yield m
-            info.status.loop_count = info.status.ammo_count / self.uri_count
+            info.status.loop_count = info.status.ammo_count // self.uri_count
 
 
 class AmmoFileReader(object):
@@ -0,0 +1,232 @@
+'''
+Parallel stpd generation. Ammo generator is read until its loops repeat,
+load plan is split into shards of consecutive charges that are formatted
+in worker processes into temporary files, which are concatenated in order,
+so that stpd is the same as one made in one process.
+'''
+import logging
+import multiprocessing as mp
+import os
+import shutil
+import tempfile
+from itertools import islice
+
+from builtins import range, zip
+
+from . import format as fmt
+from . import info
+from .missile import UriStyleGenerator
+
+logger = logging.getLogger(__name__)
+
+# charges formatted by a worker at once
+SHARD_SIZE = 100000
+# ammo bigger than that is not indexed
+INDEX_LIMIT = 256 * 1024 * 1024
+
+_index = None
+
+
+def _init_worker(index):
+    global _index
+    _index = index
+
+
+def _format_shard(task):
+    '''
+    Write stpd of a shard to a temporary file, so that formatted missiles
+    are not passed back to the parent process
+    '''
+    start, timestamps, filename = task
+    ammo = (_index[i] for i in range(start, start + len(timestamps)))
+    with open(filename, 'w') as shard:
+        shard.writelines(fmt.Stpd(
+            (timestamp, marker, missile)
+            for timestamp, (missile, marker)
+            in zip(timestamps.tolist(), ammo)))
+    return len(timestamps), filename
+
+
+class AmmoIndex(object):
+    '''
+    Filtered ammo of ammo generator: ammo before the repeated loop and
+    ammo of the loop. Loop counts of every missile read are kept, so that
+    loop count is set as if ammo was read for every charge
+    '''
+
+    def __init__(self, ammo, positions, loops, start, period, uri_count=None):
+        # ammo[first:] is the ammo of the loop
+        self.first = sum(1 for position in positions if position < start)
+        self.size = self.first + sum(
+            1 for position in positions if start <= position < start + period)
+        self.ammo = ammo[:self.size]
+        self.positions = positions
+        self.loops = loops
+        self.start = start
+        self.period = period
+        self.uri_count = uri_count
+
+    def __getitem__(self, charge):
+        if charge < self.size:
+            return self.ammo[charge]
+        return self.ammo[self.first + (charge - self.first) %
+                         (self.size - self.first)]
+
+    def __getstate__(self):
+        # workers need no loop counts
+        return self.ammo, self.first, self.size
+
+    def __setstate__(self, state):
+        self.ammo, self.first, self.size = state
+
+    def loop_count(self, charges):
+        '''
+        Loop count after ammo for charges was read
+        '''
+        last = charges - 1
+        if last < len(self.positions):
+            read = self.positions[last] + 1
+        else:
+            loops, offset = divmod(
+                last - self.first, self.size - self.first)
+            read = loops * self.period + \
+                self.positions[self.first + offset] + 1
+        if self.uri_count:
+            # UriStyleGenerator counts loops by ammo count when resumed
+            return (charges - 1) // self.uri_count if read > 1 \
+                else self.loops[0]
+        if read <= len(self.loops):
+            return self.loops[read - 1]
+        # loop count grows by the same number every loop
+        loops, offset = divmod(read - 1 - self.start, self.period)
+        return self.loops[self.start + offset] + loops * (
+            self.loops[self.start + self.period] - self.loops[self.start])
+
+
+def _repeats(items, bounds):
+    '''
+    Last two loops read are the same
+    '''
+    if len(bounds) < 3:
+        return False
+    previous, last = bounds[-3:-1], bounds[-2:]
+    return previous[1] - previous[0] == last[1] - last[0] and all(
+        a[:2] == b[:2] for a, b in zip(
+            islice(items, previous[0], previous[1]),
+            islice(items, last[0], last[1])))
+
+
+def index_ammo(af, charges):
+    '''
+    AmmoIndex of AmmoFactory ammo for charges. Ammo is read until two loops
+    in a row are the same (file readers count loops when they rewind,
+    headers of uri-style files are kept from the previous loop, so the
+    first loop may differ) or until there is ammo for every charge.
+    Stepper status is updated as stepper does it while reading, ammo
+    generator may rely on it. None if ammo can't be indexed, AmmoFactory
+    gets a new ammo generator then
+    '''
+    status = info.status
+    loop_count, ammo_count = status.loop_count, status.ammo_count
+    generator = af.ammo_generator
+    uri_count = generator.uri_count \
+        if isinstance(generator, UriStyleGenerator) else None
+    # (missile, marker, loop count) of every missile read
+    items = []
+    ammo = []
+    positions = []
+    # positions where loops start
+    bounds = [0]
+    size = 0
+    index = None
+    for missile, marker in generator:
+        loop = status.loop_count
+        if len(items) == uri_count:
+            # uris are cycled, loops are the same
+            index = (0, uri_count)
+            break
+        if uri_count is None and items and loop != items[-1][2]:
+            bounds.append(len(items))
+            if _repeats(items, bounds):
+                index = (bounds[-3], bounds[-2] - bounds[-3])
+                break
+            if len(bounds) > 3:
+                break
+        missile = af.intern(missile)
+        items.append((missile, marker, loop))
+        item = (missile, marker or af.marker(missile))
+        if af.filter(item):
+            positions.append(len(items) - 1)
+            ammo.append(item)
+            size += len(missile)
+            if len(ammo) == charges:
+                index = (len(items), 0)
+                break
+            status.ammo_count = len(ammo)
+        if size > INDEX_LIMIT:
+            break
+    status.ammo_count = ammo_count
+    if index is not None:
+        index = AmmoIndex(ammo, positions, [
+            loop for _, _, loop in items
+        ], index[0], index[1], uri_count)
+        if index.size > index.first or len(ammo) == charges:
+            return index
+    status.loop_count = loop_count
+    af.ammo_generator = af.factory.get_ammo_generator()
+    return None
+
+
+def _shards(load_plan, directory=None):
+    start = 0
+    for number, timestamps in enumerate(load_plan.chunks(SHARD_SIZE)):
+        yield start, timestamps, directory and os.path.join(
+            directory, 'shard_%d.stpd' % number)
+        start += len(timestamps)
+
+
+class ShardedStpd(object):
+    '''
+    Writes stpd of AmmoFactory in worker processes
+    '''
+
+    def __init__(self, af, workers):
+        self.af = af
+        self.workers = workers
+
+    def write(self, f):
+        '''
+        False if ammo can't be indexed, nothing is written then and
+        AmmoFactory is left to be written in one process
+        '''
+        charges = sum(
+            len(timestamps) for _, timestamps, _ in _shards(self.af.load_plan))
+        if not charges:
+            return False
+        index = index_ammo(self.af, charges)
+        if index is None:
+            logger.info("Ammo can't be indexed, stepping in one process")
+            return False
+        logger.info(
+            "Stepping in %s processes, %s missiles in ammo index",
+            self.workers, index.size)
+        directory = tempfile.mkdtemp(prefix='stpd_shards_')
+        pool = mp.Pool(self.workers, _init_worker, (index, ))
+        try:
+            shards = _shards(self.af.load_plan, directory)
+            # a few shards at a time, so that timestamps of the whole plan
+            # are not queued and shard files are removed as they are copied
+            batch = list(islice(shards, self.workers * 2))
+            while batch:
+                for count, filename in pool.imap(_format_shard, batch):
+                    with open(filename) as shard:
+                        shutil.copyfileobj(shard, f)
+                    os.remove(filename)
+                    info.status.ammo_count += count
+                batch = list(islice(shards, self.workers * 2))
+        finally:
+            pool.terminate()
+            pool.join()
+            shutil.rmtree(directory, ignore_errors=True)
+        info.status.loop_count = index.loop_count(charges)
+        return True
@@ -0,0 +1,81 @@
+import os
+
+import pytest
+from yandextank.stepper import format as fmt
+from yandextank.stepper.module_exceptions import StpdFileError
+
+MISSILES = [
+    'GET / HTTP/1.1\r\n\r\n',
+    'GET /search?text=tank HTTP/1.1\r\nHost: example.com\r\n\r\n',
+    'POST /upload HTTP/1.1\r\nContent-Length: 5\r\n\r\nhello',
+]
+
+
+def ammo(count):
+    return [(
+        i * 7, ('marker%d' % (i % 4)) if i % 5 else '',
+        MISSILES[i % len(MISSILES)]) for i in range(count)]
+
+
+def write(filename, missiles, binary):
+    with open(filename, 'wb' if binary else 'w') as stpd:
+        if binary:
+            writer = fmt.StpdWriter(stpd)
+            for timestamp, marker, missile in missiles:
+                writer.write(timestamp, marker, missile)
+            writer.close()
+        else:
+            for chunk in fmt.Stpd(missiles):
+                stpd.write(chunk)
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(fmt, 'CHUNK_SIZE', 100)
+
+
+class TestStpdReader(object):
+    def test_interned(self, tmpdir):
+        text = str(tmpdir.join('a.stpd'))
+        write(text, ammo(30), False)
+        missiles = [task[1] for task in fmt.StpdReader(text)]
+        assert len(set(id(missile) for missile in missiles)) == len(MISSILES)
+
+
+class TestStpdBin(object):
+    def test_read(self, tmpdir, small_chunks):
+        missiles = ammo(1000)
+        text, binary = str(tmpdir.join('a.stpd')), str(tmpdir.join('a.stpdb'))
+        write(text, missiles, False)
+        write(binary, missiles, True)
+        assert isinstance(fmt.stpd_reader(binary), fmt.StpdBinReader)
+        assert isinstance(fmt.stpd_reader(text), fmt.StpdReader)
+        assert list(fmt.stpd_reader(binary)) == list(fmt.stpd_reader(text))
+        assert os.path.getsize(binary) < os.path.getsize(text) / 2
+
+    @pytest.mark.parametrize(
+        'timestamp, position', [
+            (-5, 0), (0, 0), (1, 1), (7, 1), (999, 143), (1001, 143),
+            (3500, 500), (6993, 999), (6994, 1000), (100000, 1000)
+        ])
+    def test_seek(self, tmpdir, small_chunks, timestamp, position):
+        binary = str(tmpdir.join('a.stpdb'))
+        missiles = ammo(1000)
+        write(binary, missiles, True)
+        reader = fmt.StpdBinReader(binary)
+        assert reader.seek(timestamp) == position
+        assert [task[0] for task in reader] == [
+            missile[0] for missile in missiles[position:]]
+
+    def test_no_index(self, tmpdir):
+        binary = str(tmpdir.join('a.stpdb'))
+        write(binary, list(reversed(ammo(10))), True)
+        reader = fmt.StpdBinReader(binary)
+        assert len(list(reader)) == 10
+        with pytest.raises(StpdFileError):
+            reader.seek(0)
+
+    def test_empty(self, tmpdir):
+        binary = str(tmpdir.join('a.stpdb'))
+        write(binary, [], True)
+        assert list(fmt.StpdBinReader(binary)) == []
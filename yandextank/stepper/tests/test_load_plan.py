@@ -1,3 +1,4 @@
+import numpy as np
 import pytest
 from yandextank.stepper.load_plan import create, Const, Line, Composite, Stairway
 from yandextank.stepper.util import take
@@ -146,3 +147,61 @@ class TestCreate(object):
     def test_create(self, rps_schedule, check_point, expected):
         # pytest.set_trace()
         assert take(check_point, (create(rps_schedule))) == expected
+
+
+def baseline_timestamps(load_plan):
+    """
+    Timestamps as load plans generated them one by one before chunks
+    """
+    if isinstance(load_plan, Composite):
+        base = 0
+        for step in load_plan.steps:
+            for ts in baseline_timestamps(step):
+                yield ts + base
+            base += step.get_duration()
+    elif isinstance(load_plan, Const):
+        if load_plan.rps:
+            interval = 1000.0 / load_plan.rps
+            for i in range(int(load_plan.rps * load_plan.duration / 1000)):
+                yield int(i * interval)
+    else:
+        for n in range(len(load_plan)):
+            yield load_plan.ts(n)
+
+
+class TestChunks(object):
+    @pytest.mark.parametrize(
+        'load_plan', [
+            Const(1.5, 10000),
+            Const(0, 10000),
+            Line(1.1, 5.8, 20000),
+            Line(10, 0, 25000),
+            Line(10, 10, 20000),
+            Stairway(1.2, 5.7, 1.1, 5000),
+            Composite([Line(0, 10, 20000), Const(10, 10000)]),
+        ])
+    def test_chunks(self, load_plan):
+        chunks = list(load_plan.chunks(7))
+        assert all(len(chunk) <= 7 for chunk in chunks)
+        timestamps = np.concatenate(chunks).tolist() if chunks else []
+        assert timestamps == list(baseline_timestamps(load_plan))
+        assert list(load_plan) == timestamps
+
+    @pytest.mark.parametrize(
+        'load_plan, expected', [
+            (Const(2, 3000), [[0, 500, 1000, 1500], [2000, 2500]]),
+            (Line(1, 5, 2000), [[0, 618, 1000, 1302], [1561, 1791]]),
+            (Composite([Const(1, 2000), Line(2, 4, 1000)]),
+             [[0, 1000], [2000, 2414], [2732]]),
+        ])
+    def test_chunk_timestamps(self, load_plan, expected):
+        size = len(expected[0])
+        assert [
+            chunk.tolist() for chunk in load_plan.chunks(size)
+        ] == expected
+
+    def test_line_ts(self):
+        load_plan = Line(1.1, 5.8, 20000)
+        n = np.arange(len(load_plan))
+        assert load_plan.ts_array(n).tolist() == [
+            load_plan.ts(i) for i in range(len(load_plan))]
@@ -0,0 +1,76 @@
+import tempfile
+
+import pytest
+from yandextank.stepper import info, shards
+from yandextank.stepper.main import Stepper
+
+URIS = ['/', '/search?text=tank', '/upload', '/search?text=bfg']
+
+
+class HeaderReader(object):
+    '''
+    Header is added in the middle of the first loop and is kept, like
+    headers of uri-style ammo files are
+    '''
+
+    def __iter__(self):
+        header = ''
+        while True:
+            for uri in URIS:
+                yield 'GET %s HTTP/1.1\r\n%s\r\n' % (uri, header), None
+                if uri == '/upload':
+                    header = 'Connection: close\r\n'
+            info.status.inc_loop_count()
+
+
+def make_stpd(filename, workers, ammo=None, **kwargs):
+    stepper = Stepper(
+        None, workers=workers, uris=URIS, headers=[], autocases=2, **kwargs)
+    if ammo is not None:
+        stepper.af.ammo_generator = ammo
+    with open(filename, 'w') as stpd:
+        stepper.write(stpd)
+    with open(filename) as stpd:
+        return stpd.read(), info.status.ammo_count, info.status.loop_count
+
+
+@pytest.fixture
+def small_shards(monkeypatch):
+    monkeypatch.setattr(shards, 'SHARD_SIZE', 700)
+
+
+@pytest.mark.parametrize('options', [
+    {},
+    {'chosen_cases': ['_search']},
+    {'ammo_limit': 500},
+])
+@pytest.mark.parametrize('schedule', [
+    ['line(1, 2000, 5s)', 'const(300, 3s)'],
+    ['const(1, 3s)'],
+])
+@pytest.mark.parametrize('ammo', [None, HeaderReader])
+def test_sharded(tmpdir, small_shards, ammo, schedule, options):
+    options = dict(options, rps_schedule=schedule)
+    expected = make_stpd(
+        str(tmpdir.join('expected')), 0, ammo and ammo(), **options)
+    sharded = make_stpd(
+        str(tmpdir.join('sharded')), 3, ammo and ammo(), **options)
+    assert sharded == expected
+    assert isinstance(sharded[2], int)
+
+
+def test_shard_files(tmpdir, small_shards, monkeypatch):
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmpdir))
+    options = {'rps_schedule': ['const(1000, 5s)']}
+    expected = make_stpd(str(tmpdir.join('expected')), 0, **options)
+    assert make_stpd(str(tmpdir.join('sharded')), 3, **options) == expected
+    # shard files are removed
+    assert sorted(path.basename for path in tmpdir.listdir()) == [
+        'expected', 'sharded']
+
+
+def test_not_indexed(tmpdir, small_shards, monkeypatch):
+    monkeypatch.setattr(shards, 'INDEX_LIMIT', 100)
+    options = {'rps_schedule': ['const(100, 10s)']}
+    expected = make_stpd(str(tmpdir.join('expected')), 0, **options)
+    assert make_stpd(str(tmpdir.join('sharded')), 3, **options) == expected
@@ -60,6 +60,33 @@ def solve_quadratic(a, b, c):
     return (root1, root2)
 
 
+class Interner(object):
+    '''
+    Returns the same object for equal missiles, so that repeated missiles
+    are kept in memory once. Missiles are remembered until their total size
+    reaches limit, later new ones are returned as they are
+
+    >>> intern = Interner()
+    >>> first = intern(''.join(['GET / HTTP/1.1', '\\r\\n\\r\\n']))
+    >>> intern(''.join(['GET / HTTP/1.1', '\\r\\n\\r\\n'])) is first
+    True
+    '''
+
+    def __init__(self, limit=64 * 1024 * 1024):
+        self.limit = limit
+        self.size = 0
+        self.known = {}
+
+    def __call__(self, missile):
+        known = self.known.get(missile)
+        if known is not None:
+            return known
+        if self.size < self.limit:
+            self.known[missile] = missile
+            self.size += len(missile)
+        return missile
+
+
 def s_to_ms(f_sec):
     return int(f_sec * 1000.0)
 